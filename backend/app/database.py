@@ -1,20 +1,71 @@
 import logging
 from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
+from app.metrics import mongo_command_metrics
 import os
 
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+# Notifications are deleted by Mongo's TTL monitor this long after they were last sent
+NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-try:
-    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-    db = client.p2p_lending
-    # Test the connection
-    client.admin.command('ping')
-    logger.info("Successfully connected to the MongoDB database.")
-except ServerSelectionTimeoutError:
-    logger.error("Failed to connect to the MongoDB database.")
+# Clients connect lazily on their first operation; readiness is checked by /ready
+client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, event_listeners=[mongo_command_metrics])
+db = client.p2p_lending
+
+# Non-blocking client for the request path; background jobs keep using `db`
+async_client = AsyncIOMotorClient(MONGO_URI, serverSelectionTimeoutMS=5000, maxPoolSize=MONGO_MAX_POOL_SIZE, event_listeners=[mongo_command_metrics])
+async_db = async_client.p2p_lending
+
+
+def ensure_indexes():
+    # Anchored prefix search on the lowercased name and email
+    db.users.create_index("name_lower")
+    db.users.create_index("email_lower")
+    # Top-scorers leaderboard
+    db.users.create_index([("score", -1)])
+    # Friend graph, one edge per direction; also serves paging through a user's friends
+    db.friendships.create_index([("user_id", 1), ("friend_id", 1)], unique=True)
+    # Local loan index materialized from LoanContract events
+    # (borrower|lender, _id) also serves keyset pagination of loan listings
+    db.loans.create_index([("borrower", 1), ("_id", 1)])
+    db.loans.create_index([("lender", 1), ("_id", 1)])
+    # Due-date range scans for the reminder scheduler
+    db.loans.create_index([("status", 1), ("due_date", 1)])
+    # Sent reminders only need to be remembered while a loan can still be due
+    db.reminders.create_index("sent_at", expireAfterSeconds=7 * 24 * 3600)
+    db.loan_events.create_index("loan_id")
+    db.loan_events.create_index("block_number")
+    # Live loan updates follow the event log in seq order
+    db.loan_events.create_index("seq")
+    # Notification inbox, newest first per user
+    db.notifications.create_index([("user_id", 1), ("timestamp", -1), ("_id", -1)])
+    # One record per user for repeated messages such as daily loan reminders
+    db.notifications.create_index(
+        [("collapse_key", 1), ("user_id", 1)],
+        unique=True,
+        partialFilterExpression={"collapse_key": {"$type": "string"}},
+    )
+    retention_seconds = NOTIFICATION_RETENTION_DAYS * 24 * 3600
+    try:
+        db.notifications.create_index("created_at", expireAfterSeconds=retention_seconds)
+    except OperationFailure:
+        # The retention setting changed since the index was built
+        db.command("collMod", "notifications", index={"keyPattern": {"created_at": 1}, "expireAfterSeconds": retention_seconds})
+    # Notification outbox polling and claiming
+    db.notification_outbox.create_index("next_attempt_at")
+    db.notification_outbox.create_index("claim_id")
+    db.notification_outbox.create_index("token")
+    # Built last: users sharing a wallet address make it fail, and the other indexes must not
+    # wait on that. The 0007_unique_public_keys migration takes the shared addresses away first.
+    try:
+        # Wallet address lookups; users without a public key yet are left out of the index
+        db.users.create_index("public_key", unique=True, partialFilterExpression={"public_key": {"$type": "string"}})
+    except OperationFailure:
+        logger.exception("Could not build the unique public_key index; duplicate wallet addresses remain.")
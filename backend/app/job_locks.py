@@ -0,0 +1,88 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from uuid import uuid4
+from pymongo.errors import DuplicateKeyError
+from app.database import db
+from app.metrics import JOB_DURATION, JOB_RUNS
+
+logger = logging.getLogger(__name__)
+
+# A running job renews its lease every third of this; a crashed holder is replaced after it
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Identifies this process as a lock holder
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
+def _acquire(name, now):
+    try:
+        # Matches an expired lock, or inserts one; a live lock held elsewhere raises DuplicateKeyError
+        db.job_locks.update_one(
+            {"_id": name, "locked_until": {"$lte": now}},
+            {"$set": {"owner": OWNER_ID, "started_at": now, "locked_until": now + timedelta(seconds=JOB_LEASE_SECONDS)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+def _keep_leased(name, stop):
+    while not stop.wait(JOB_LEASE_SECONDS / 3):
+        result = db.job_locks.update_one(
+            {"_id": name, "owner": OWNER_ID},
+            {"$set": {"locked_until": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)}},
+        )
+        if result.matched_count == 0:
+            logger.warning(f"Lost the lease on job {name}.")
+            return
+
+
+def run_exclusive(name, func, interval_seconds, *args):
+    """
+    Run func(*args) unless another process ran job `name` within the last interval or is
+    running it now. Returns whether it ran here.
+    """
+    # Shards of a job share its metrics, e.g. check_due_loans:3 is counted as check_due_loans
+    job = name.split(":")[0]
+    started = datetime.utcnow()
+    try:
+        if not _acquire(name, started):
+            JOB_RUNS.labels(job, "skipped").inc()
+            return False
+    except Exception as e:
+        logger.error(f"Could not take the lock of job {name}: {e}")
+        JOB_RUNS.labels(job, "failed").inc()
+        return False
+
+    stop = threading.Event()
+    renewer = threading.Thread(target=_keep_leased, args=(name, stop), daemon=True)
+    renewer.start()
+    outcome = "failed"
+    try:
+        with JOB_DURATION.labels(job).time():
+            func(*args)
+        outcome = "ran"
+    finally:
+        JOB_RUNS.labels(job, outcome).inc()
+        stop.set()
+        renewer.join()
+        # Keep the lock for most of the interval so the same job firing a little later in
+        # another process does not run it a second time
+        db.job_locks.update_one(
+            {"_id": name, "owner": OWNER_ID},
+            {"$set": {"locked_until": started + timedelta(seconds=interval_seconds * 0.9)}},
+        )
+    return True
+
+
+def exclusive_job(name, func, interval_seconds):
+    """
+    Wrap func as a scheduler job that runs in only one process per interval.
+    """
+    def job():
+        run_exclusive(name, func, interval_seconds)
+    job.__name__ = func.__name__
+    return job
@@ -0,0 +1,276 @@
+import functools
+import logging
+import os
+import threading
+import time
+from pymongo import UpdateOne
+from web3 import Web3
+from web3.exceptions import BlockNotFound
+from app.utils import web3, get_loan_contract, db, invalidate_loan
+
+logger = logging.getLogger(__name__)
+
+# Indexer settings
+INDEXER_START_BLOCK = int(os.getenv("CONTRACT_DEPLOY_BLOCK", "0"))
+INDEXER_BATCH_BLOCKS = int(os.getenv("INDEXER_BATCH_BLOCKS", "2000"))
+INDEXER_CONFIRMATIONS = int(os.getenv("INDEXER_CONFIRMATIONS", "0"))
+INDEXER_REORG_DEPTH = int(os.getenv("INDEXER_REORG_DEPTH", "64"))
+INDEXER_INTERVAL_SECONDS = int(os.getenv("INDEXER_INTERVAL_SECONDS", "15"))
+CHECKPOINT_ID = "loan_indexer"
+# The contract accepts any uint for due dates; later ones are stored as the end of year 9999,
+# which fits in a BSON int64 and still converts to a datetime
+MAX_DUE_DATE = 253402300799
+DUE_DATE_ARGS = ("dueDate", "requestedDueDate", "newDueDate")
+BSON_INT64_MAX = 2 ** 63 - 1
+
+# Mirrors LoanContract.LoanStatus
+PENDING, APPROVED, REPAID, REJECTED = range(4)
+
+# Reputation points per loan outcome
+SCORE_REPAID_ON_TIME = 10
+SCORE_REPAID_LATE = 4
+SCORE_RENEGOTIATED = -2
+SCORE_DEFAULTED = -15
+SCORE_FUNDED = 1
+
+# Points a loan contributes to its borrower and to its lender
+BORROWER_POINTS = {"$add": [
+    {"$switch": {
+        "branches": [
+            {"case": {"$and": [{"$eq": ["$status", REPAID]}, {"$lte": ["$last_modified_at", "$due_date"]}]}, "then": SCORE_REPAID_ON_TIME},
+            {"case": {"$eq": ["$status", REPAID]}, "then": SCORE_REPAID_LATE},
+            {"case": {"$eq": ["$defaulted", True]}, "then": SCORE_DEFAULTED},
+        ],
+        "default": 0,
+    }},
+    {"$multiply": [{"$ifNull": ["$renegotiations", 0]}, SCORE_RENEGOTIATED]},
+]}
+LENDER_POINTS = {"$cond": [{"$in": ["$status", [APPROVED, REPAID]]}, SCORE_FUNDED, 0]}
+
+LOAN_EVENTS = (
+    "LoanRequested",
+    "LoanApproved",
+    "LoanRejected",
+    "LoanRepaid",
+    "DueDateRenegotiationRequested",
+    "DueDateRenegotiationApproved",
+)
+
+# Maps the topic0 hash of each indexed event to its name
+@functools.cache
+def _event_topics():
+    return {
+        bytes(Web3.keccak(text=f"{entry['name']}({','.join(i['type'] for i in entry['inputs'])})")): entry["name"]
+        for entry in get_loan_contract().abi
+        if entry.get("type") == "event" and entry["name"] in LOAN_EVENTS
+    }
+
+_sync_lock = threading.Lock()
+
+
+def _event_seq(block_number, log_index):
+    # Total order of events on chain, used to apply each event to a loan at most once
+    return block_number * 100000 + log_index
+
+
+def _event_document(name, event, timestamp):
+    args = dict(event["args"])
+    if "amount" in args:
+        args["amount"] = str(args["amount"])  # uint256 does not fit in a BSON int64
+    for key in DUE_DATE_ARGS:
+        if key in args:
+            args[key] = min(args[key], MAX_DUE_DATE)
+    # Any other oversized uint is kept as a string rather than failing the whole block range
+    for key, value in args.items():
+        if isinstance(value, int) and value > BSON_INT64_MAX:
+            args[key] = str(value)
+    return {
+        "_id": f"{event['transactionHash'].hex()}:{event['logIndex']}",
+        "seq": _event_seq(event["blockNumber"], event["logIndex"]),
+        "event": name,
+        "loan_id": args["loanId"],
+        "args": args,
+        "block_number": event["blockNumber"],
+        "block_hash": event["blockHash"].hex(),
+        "timestamp": timestamp,
+    }
+
+
+def _loan_update(event):
+    """
+    Translate a stored event into the write that applies it to the materialized loan.
+    """
+    args = event["args"]
+    if event["event"] == "LoanRequested":
+        return UpdateOne({"_id": event["loan_id"]}, {"$setOnInsert": {
+            "borrower": args["borrower"],
+            "lender": args["lender"],
+            "amount": args["amount"],
+            "collateral": args["collateral"],
+            "status": PENDING,
+            "created_at": event["timestamp"],
+            "due_date": args["dueDate"],
+            "last_modified_at": event["timestamp"],
+            "requested_due_date": 0,
+            "renegotiation_requested": False,
+            "renegotiations": 0,
+            "defaulted": False,
+            "seq": event["seq"],
+        }}, upsert=True)
+
+    update = {}
+    if event["event"] == "LoanApproved":
+        changes = {"status": APPROVED, "last_modified_at": event["timestamp"]}
+    elif event["event"] == "LoanRejected":
+        changes = {"status": REJECTED, "last_modified_at": event["timestamp"]}
+    elif event["event"] == "LoanRepaid":
+        changes = {"status": REPAID, "last_modified_at": event["timestamp"]}
+    elif event["event"] == "DueDateRenegotiationRequested":
+        changes = {"requested_due_date": args["requestedDueDate"], "renegotiation_requested": True}
+    else:  # DueDateRenegotiationApproved
+        changes = {"due_date": args["newDueDate"], "last_modified_at": event["timestamp"], "renegotiation_requested": False, "defaulted": False}
+        update["$inc"] = {"renegotiations": 1}
+    changes["seq"] = event["seq"]
+    update["$set"] = changes
+    # Replaying an already applied event is a no-op
+    return UpdateOne({"_id": event["loan_id"], "seq": {"$lt": event["seq"]}}, update)
+
+
+def _loan_parties(loan_ids):
+    parties = set()
+    for loan in db.loans.find({"_id": {"$in": list(loan_ids)}}, {"borrower": 1, "lender": 1}):
+        parties.update((loan["borrower"], loan["lender"]))
+    return parties
+
+
+def update_scores(addresses):
+    """
+    Recompute the reputation score of the users owning these addresses from their loans.
+    """
+    scores = dict.fromkeys(addresses, 0)
+    if not scores:
+        return
+    for role, points in (("borrower", BORROWER_POINTS), ("lender", LENDER_POINTS)):
+        for row in db.loans.aggregate([
+            {"$match": {role: {"$in": list(scores)}}},
+            # Loans to oneself would let an address farm points for the cost of gas
+            {"$match": {"$expr": {"$ne": ["$borrower", "$lender"]}}},
+            {"$group": {"_id": f"${role}", "points": {"$sum": points}}},
+        ]):
+            scores[row["_id"]] += row["points"]
+    db.users.bulk_write(
+        [UpdateOne({"public_key": address}, {"$set": {"score": score}}) for address, score in scores.items()],
+        ordered=False,
+    )
+
+
+def mark_defaults():
+    """
+    Flag approved loans that are past their due date and lower their borrowers' scores.
+    """
+    try:
+        overdue = list(db.loans.find(
+            {"status": APPROVED, "due_date": {"$lt": int(time.time())}, "defaulted": {"$ne": True}},
+            {"borrower": 1, "lender": 1},
+        ))
+        if not overdue:
+            return
+        # The status filter is repeated so a loan repaid in the meantime is left alone
+        db.loans.update_many({"_id": {"$in": [loan["_id"] for loan in overdue]}, "status": APPROVED}, {"$set": {"defaulted": True}})
+        update_scores({loan["borrower"] for loan in overdue})
+    except Exception as e:
+        logger.error(f"Marking defaulted loans failed: {e}")
+
+
+def _save_checkpoint(block_number, block_hash):
+    db.indexer_state.update_one(
+        {"_id": CHECKPOINT_ID},
+        {"$set": {"last_block": block_number, "last_block_hash": block_hash}},
+        upsert=True,
+    )
+
+
+def _is_reorged(checkpoint):
+    if checkpoint.get("last_block_hash") is None:
+        return False
+    try:
+        block = web3.eth.get_block(checkpoint["last_block"])
+    except BlockNotFound:
+        return True
+    return block["hash"].hex() != checkpoint["last_block_hash"]
+
+
+def _rewind(last_block):
+    """
+    Drop everything indexed after the fork point and rebuild the affected loans from the events that remain.
+    """
+    fork_block = max(INDEXER_START_BLOCK - 1, last_block - INDEXER_REORG_DEPTH)
+    logger.warning("Chain reorg detected at block %s, rewinding loan index to block %s.", last_block, fork_block)
+
+    stale_loan_ids = db.loan_events.distinct("loan_id", {"block_number": {"$gt": fork_block}})
+    db.loan_events.delete_many({"block_number": {"$gt": fork_block}})
+    if stale_loan_ids:
+        parties = _loan_parties(stale_loan_ids)
+        db.loans.delete_many({"_id": {"$in": stale_loan_ids}})
+        replay = db.loan_events.find({"loan_id": {"$in": stale_loan_ids}}).sort("seq", 1)
+        updates = [_loan_update(event) for event in replay]
+        if updates:
+            db.loans.bulk_write(updates)
+        update_scores(parties)
+
+    _save_checkpoint(fork_block, None)
+    return fork_block
+
+
+def _process_range(from_block, to_block):
+    loan_contract = get_loan_contract()
+    logs = web3.eth.get_logs({"address": loan_contract.address, "fromBlock": from_block, "toBlock": to_block})
+
+    events = []
+    block_timestamps = {}
+    for log in logs:
+        name = _event_topics().get(bytes(log["topics"][0])) if log["topics"] else None
+        if name is None:
+            continue
+        event = loan_contract.events[name]().process_log(log)
+        if event["blockNumber"] not in block_timestamps:
+            block_timestamps[event["blockNumber"]] = web3.eth.get_block(event["blockNumber"])["timestamp"]
+        events.append(_event_document(name, event, block_timestamps[event["blockNumber"]]))
+
+    if events:
+        db.loan_events.bulk_write(
+            [UpdateOne({"_id": event["_id"]}, {"$setOnInsert": event}, upsert=True) for event in events],
+            ordered=False,
+        )
+        db.loans.bulk_write([_loan_update(event) for event in events])
+        loan_ids = {event["loan_id"] for event in events}
+        for loan_id in loan_ids:
+            invalidate_loan(loan_id)
+        # Only the users involved in these loans need their score refreshed
+        update_scores(_loan_parties(loan_ids))
+
+    _save_checkpoint(to_block, web3.eth.get_block(to_block)["hash"].hex())
+
+
+def sync_loans():
+    """
+    Advance the local loan index from the last checkpoint to the confirmed chain head.
+    """
+    # Scheduler jobs may overlap; one sync at a time is enough
+    if not _sync_lock.acquire(blocking=False):
+        return
+    try:
+        checkpoint = db.indexer_state.find_one({"_id": CHECKPOINT_ID})
+        last_block = checkpoint["last_block"] if checkpoint else INDEXER_START_BLOCK - 1
+        if checkpoint and _is_reorged(checkpoint):
+            last_block = _rewind(last_block)
+
+        head = web3.eth.block_number - INDEXER_CONFIRMATIONS
+        while last_block < head:
+            to_block = min(last_block + INDEXER_BATCH_BLOCKS, head)
+            _process_range(last_block + 1, to_block)
+            last_block = to_block
+    except Exception as e:
+        logger.error(f"Loan index sync failed: {e}")
+    finally:
+        _sync_lock.release()
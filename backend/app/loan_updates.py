@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from app.database import async_db
+
+logger = logging.getLogger(__name__)
+
+# Live loan update settings
+LOAN_UPDATES_POLL_SECONDS = float(os.getenv("LOAN_UPDATES_POLL_SECONDS", "1"))
+LOAN_UPDATES_BATCH_SIZE = 500
+# Messages buffered per connection before the oldest are dropped
+LOAN_UPDATES_QUEUE_SIZE = 100
+
+LOAN_FIELDS = {"borrower": 1, "lender": 1, "status": 1, "due_date": 1, "requested_due_date": 1, "renegotiation_requested": 1, "last_modified_at": 1}
+
+
+class LoanUpdateBroker:
+    """
+    In-process pub/sub of indexed loan events. Each connection subscribes with its wallet
+    address and receives the events of loans it borrowed or lent.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._last_seq = None
+
+    def subscribe(self, address: str):
+        queue = asyncio.Queue(maxsize=LOAN_UPDATES_QUEUE_SIZE)
+        self._subscribers[address].add(queue)
+        return queue
+
+    def unsubscribe(self, address: str, queue):
+        queues = self._subscribers.get(address)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[address]
+
+    def publish(self, address: str, message: dict):
+        for queue in self._subscribers.get(address, ()):
+            if queue.full():
+                # A slow client loses its oldest updates rather than holding up everyone else
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    async def _poll(self):
+        if self._last_seq is None:
+            # Start from the current end of the event log; clients load history over REST
+            latest = await async_db.loan_events.find_one({}, {"seq": 1}, sort=[("seq", -1)])
+            self._last_seq = latest["seq"] if latest else -1
+            return 0
+
+        events = await async_db.loan_events.find({"seq": {"$gt": self._last_seq}}).sort("seq", 1).limit(LOAN_UPDATES_BATCH_SIZE).to_list(None)
+        if not events:
+            return 0
+        self._last_seq = events[-1]["seq"]
+        if not self._subscribers:
+            return len(events)
+
+        loans = await async_db.loans.find({"_id": {"$in": list({event["loan_id"] for event in events})}}, LOAN_FIELDS).to_list(None)
+        loan_lookup = {loan["_id"]: loan for loan in loans}
+        for event in events:
+            loan = loan_lookup.get(event["loan_id"])
+            if loan is None:
+                continue
+            message = {
+                "type": "loan_event",
+                "event": event["event"],
+                "loan_id": event["loan_id"],
+                "block_number": event["block_number"],
+                "args": event["args"],
+                "loan": {key: value for key, value in loan.items() if key != "_id"},
+            }
+            self.publish(loan["borrower"], message)
+            if loan["lender"] != loan["borrower"]:
+                self.publish(loan["lender"], message)
+        return len(events)
+
+    async def run(self):
+        """
+        Follow the indexed loan events forever and fan them out to the subscribers.
+        """
+        while True:
+            try:
+                processed = await self._poll()
+            except Exception as e:
+                logger.error(f"Loan update polling failed: {e}")
+                processed = 0
+            # Keep going without a pause while there is a backlog
+            if processed < LOAN_UPDATES_BATCH_SIZE:
+                await asyncio.sleep(LOAN_UPDATES_POLL_SECONDS)
+
+
+broker = LoanUpdateBroker()
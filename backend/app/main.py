@@ -1,8 +1,69 @@
-from fastapi import FastAPI
+import time
+_started = time.perf_counter()
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import auth, friends, loans,notifications
+from fastapi.responses import JSONResponse
+from app.routes import auth, friends, loans,notifications, ws
 from app.notification_service import start_scheduler, shutdown_scheduler
-app = FastAPI()
+from app.database import ensure_indexes, async_client
+from app.migrations import run_migrations
+from app.notification_dispatcher import run_outbox_worker
+from app.loan_updates import broker
+from app.utils import open_rpc_session, get_chain_head
+from app.metrics import HTTP_REQUEST_LATENCY, metrics_registry
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+logger = logging.getLogger(__name__)
+
+# Per-dependency timeout of the readiness probe
+READY_TIMEOUT_SECONDS = 2
+# Backoff between attempts to prepare the database
+PREPARE_RETRY_SECONDS = 1
+PREPARE_MAX_RETRY_SECONDS = 60
+
+
+def _prepare_database():
+    run_migrations()
+    ensure_indexes()
+
+
+async def _prepare_in_background(app: FastAPI):
+    # Migrations and index builds must not hold up serving; /ready reports when they are done.
+    # Failures such as Mongo being briefly unreachable at boot are retried until they succeed.
+    delay = PREPARE_RETRY_SECONDS
+    while True:
+        try:
+            await asyncio.to_thread(_prepare_database)
+            app.state.database_prepared = True
+            return
+        except Exception:
+            logger.exception(f"Database preparation failed, retrying in {delay}s.")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, PREPARE_MAX_RETRY_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.database_prepared = False
+    app.state.rpc_session = await open_rpc_session()
+    app.state.prepare_database = asyncio.create_task(_prepare_in_background(app))
+    start_scheduler()
+    app.state.outbox_worker = asyncio.create_task(run_outbox_worker())
+    app.state.loan_updates = asyncio.create_task(broker.run())
+    logger.info(f"Cold start took {time.perf_counter() - _started:.3f}s.")
+    yield
+    app.state.prepare_database.cancel()
+    app.state.outbox_worker.cancel()
+    app.state.loan_updates.cancel()
+    await app.state.rpc_session.close()
+    shutdown_scheduler()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS
 app.add_middleware(
@@ -11,21 +72,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Next-Cursor"],  # Loan listing pagination cursor
 )
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # The matched route template, e.g. /loans/{loan_id}; unmatched paths share one label
+        route = request.scope.get("route")
+        HTTP_REQUEST_LATENCY.labels(request.method, route.path if route else "unmatched", status_code).observe(time.perf_counter() - started)
+
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(friends.router, prefix="/friends", tags=["friends"])
 app.include_router(loans.router, prefix="/loans", tags=["loans"])
 app.include_router(notifications.router, prefix="/notifications", tags=["notifications"])
+app.include_router(ws.router, prefix="/ws", tags=["ws"])
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the P2P Lending Tracker API"}
 
-@app.on_event("startup")
-async def startup_event():
-    start_scheduler()
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: MongoDB and the Ethereum node answer and the database is prepared.
+    """
+    checks = {"database_prepared": app.state.database_prepared}
+    for name, check in (("mongo", async_client.admin.command("ping")), ("chain", get_chain_head())):
+        try:
+            await asyncio.wait_for(check, READY_TIMEOUT_SECONDS)
+            checks[name] = True
+        except Exception:
+            checks[name] = False
+    return JSONResponse({"ready": all(checks.values()), "checks": checks}, status_code=200 if all(checks.values()) else 503)
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    shutdown_scheduler()
\ No newline at end of file
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Prometheus metrics of all workers when PROMETHEUS_MULTIPROC_DIR is set, else of this one.
+    """
+    return Response(generate_latest(metrics_registry()), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,112 @@
+import os
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, multiprocess
+from pymongo import monitoring
+
+# With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by
+# them (and cleared on deploy) so /metrics aggregates every worker instead of the one that
+# happened to answer the scrape
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# HTTP requests, labelled by route template so path parameters do not multiply the series
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests handled by the API",
+    ["method", "route", "status"],
+)
+
+# JSON-RPC round trips to the Ethereum node, labelled by method ("batch" for batched calls)
+RPC_LATENCY = Histogram(
+    "rpc_request_duration_seconds",
+    "Latency of JSON-RPC requests to the Ethereum node",
+    ["method"],
+)
+RPC_BATCH_SIZE = Histogram(
+    "rpc_batch_size",
+    "Number of calls sent in one JSON-RPC batch request",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200),
+)
+
+# LoanContract view calls, labelled by contract function; `source` tells cache hits from node reads
+CONTRACT_CALLS = Counter(
+    "contract_calls_total",
+    "LoanContract view calls",
+    ["function", "source"],
+)
+CONTRACT_CALL_LATENCY = Histogram(
+    "contract_call_duration_seconds",
+    "Latency of LoanContract view calls read from the node",
+    ["function"],
+)
+
+# MongoDB commands of both the sync and the async client
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongo_command_duration_seconds",
+    "Latency of MongoDB commands",
+    ["command", "collection"],
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongo_command_failures_total",
+    "MongoDB commands that failed",
+    ["command", "collection"],
+)
+
+# Scheduler jobs; `outcome` is ran, skipped (held by another process) or failed
+JOB_DURATION = Histogram(
+    "job_duration_seconds",
+    "Duration of scheduler jobs",
+    ["job"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+JOB_RUNS = Counter(
+    "job_runs_total",
+    "Scheduler job runs",
+    ["job", "outcome"],
+)
+
+# FCM deliveries; `outcome` is success, batch_failed or the FCM exception name
+FCM_SENDS = Counter(
+    "fcm_sends_total",
+    "Messages sent through FCM",
+    ["outcome"],
+)
+FCM_BATCH_LATENCY = Histogram(
+    "fcm_batch_duration_seconds",
+    "Latency of FCM send_each batches",
+)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener recording the latency of every command per collection.
+    """
+
+    def __init__(self):
+        # Collection of each command in flight; completion events only carry the command name
+        self._collections = {}
+
+    def started(self, event):
+        collection = event.command.get("collection") if event.command_name == "getMore" else event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_LATENCY.labels(event.command_name, collection).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_LATENCY.labels(event.command_name, collection).observe(event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.labels(event.command_name, collection).inc()
+
+
+mongo_command_metrics = MongoCommandMetrics()
+
+
+def metrics_registry():
+    """
+    Registry to expose: all workers' metrics in multiprocess mode, this process's otherwise.
+    """
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
@@ -0,0 +1,122 @@
+import logging
+import time
+from datetime import datetime
+from pymongo import UpdateOne
+from app.database import db
+from app.loan_indexer import update_scores
+from app.routes.friends import friendship_edges
+from app.notification_dispatcher import reconcile_unread_counts
+from app.job_locks import run_exclusive
+
+logger = logging.getLogger(__name__)
+
+# How often a process waiting for another one's migrations checks again
+MIGRATION_WAIT_SECONDS = 2
+
+
+def backfill_user_search_fields():
+    # Lowercased copies of name and email for indexed prefix search
+    db.users.update_many(
+        {"name_lower": {"$exists": False}},
+        [{"$set": {"name_lower": {"$toLower": "$name"}, "email_lower": {"$toLower": "$email"}}}],
+    )
+
+
+def compute_user_scores():
+    # Scores of every party from scratch; later loan events keep them current
+    update_scores(set(db.loans.distinct("borrower")) | set(db.loans.distinct("lender")))
+
+
+def move_friends_to_edges():
+    # Embedded friends arrays become friendship edges and are then dropped from the users
+    for user in db.users.find({"friends": {"$exists": True}}, {"friends": 1}):
+        edges = [edge for friend_id in user["friends"] for edge in friendship_edges(user["_id"], friend_id)]
+        if edges:
+            db.friendships.bulk_write(edges, ordered=False)
+    db.users.update_many({"friends": {"$exists": True}}, {"$unset": {"friends": ""}})
+
+
+def backfill_notification_inbox():
+    # Older notifications had no timestamp or read state; unread counters start from them
+    db.notifications.update_many({"timestamp": {"$exists": False}}, {"$set": {"timestamp": 0}})
+    db.notifications.update_many({"read": {"$exists": False}}, {"$set": {"read": False}})
+    unread = db.notifications.aggregate([
+        {"$match": {"read": False}},
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+    ])
+    updates = [UpdateOne({"_id": row["_id"]}, {"$set": {"unread_notifications": row["count"]}}) for row in unread]
+    if updates:
+        db.users.bulk_write(updates, ordered=False)
+
+
+def compact_notifications():
+    # Date field for the TTL index; notifications without a known send time start their retention now
+    db.notifications.update_many({"created_at": {"$exists": False}}, [{"$set": {"created_at": {"$cond": [
+        {"$gt": ["$timestamp", 0]},
+        {"$toDate": {"$multiply": ["$timestamp", 1000]}},
+        "$$NOW",
+    ]}}}])
+    # Fold identical repeated loan reminders into the newest copy
+    duplicates = db.notifications.aggregate([
+        {"$match": {"title": "Loan Due", "collapse_key": {"$exists": False}}},
+        {"$sort": {"timestamp": -1}},
+        {"$group": {"_id": {"user_id": "$user_id", "body": "$body"}, "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ], allowDiskUse=True)
+    for group in duplicates:
+        keep, *extra = group["ids"]
+        db.notifications.update_one({"_id": keep}, {"$set": {"count": len(group["ids"])}})
+        db.notifications.delete_many({"_id": {"$in": extra}})
+    reconcile_unread_counts()
+
+
+def flag_shared_public_keys():
+    # Before public keys were unique several users could link the same wallet. There is no
+    # telling which of them owns it, so it is taken from all of them and kept for review.
+    shared = db.users.aggregate([
+        {"$match": {"public_key": {"$type": "string"}}},
+        {"$group": {"_id": "$public_key", "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ], allowDiskUse=True)
+    for group in shared:
+        logger.warning(f"Public key {group['_id']} was shared by users {group['ids']}; unlinked it from all of them.")
+        db.users.update_many(
+            {"_id": {"$in": group["ids"]}},
+            {"$set": {"conflicting_public_key": group["_id"]}, "$unset": {"public_key": ""}},
+        )
+
+
+# Applied in order, each at most once per database
+MIGRATIONS = [
+    ("0001_user_search_fields", backfill_user_search_fields),
+    ("0002_user_scores", compute_user_scores),
+    ("0003_friendship_edges", move_friends_to_edges),
+    ("0004_notification_inbox", backfill_notification_inbox),
+    ("0005_notification_retention", compact_notifications),
+    ("0006_scores_without_self_loans", compute_user_scores),
+    ("0007_unique_public_keys", flag_shared_public_keys),
+]
+
+
+def _pending_migrations():
+    applied = {migration["_id"] for migration in db.migrations.find({}, {"_id": 1})}
+    return [(name, migrate) for name, migrate in MIGRATIONS if name not in applied]
+
+
+def _apply_pending():
+    # Read again under the lock: another process may have finished them meanwhile
+    for name, migrate in _pending_migrations():
+        logger.info(f"Applying migration {name}.")
+        migrate()
+        db.migrations.update_one({"_id": name}, {"$setOnInsert": {"applied_at": datetime.utcnow()}}, upsert=True)
+
+
+def run_migrations():
+    """
+    Apply the pending migrations. Every worker calls this at startup; one of them applies
+    them under a job lock while the others wait until they are done.
+    """
+    while _pending_migrations():
+        # An interval of 0 releases the lock as soon as the migrations finish
+        if not run_exclusive("migrations", _apply_pending, 0):
+            time.sleep(MIGRATION_WAIT_SECONDS)
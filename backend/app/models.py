@@ -6,4 +6,3 @@ class User(BaseModel):
     id: str = Field(alias="_id")
     email: str
     public_key: Optional[str] = None
-    friends: List[str] = []
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from uuid import uuid4
+from firebase_admin import messaging
+from pymongo import UpdateOne, UpdateMany
+from app.database import db, async_db
+from app.utils import get_firebase_app
+from app.metrics import FCM_SENDS, FCM_BATCH_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# FCM accepts at most 500 messages per send_each call
+FCM_BATCH_SIZE = 500
+FCM_MAX_WORKERS = int(os.getenv("FCM_MAX_WORKERS", "4"))
+
+# Outbox settings
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_BACKOFF_SECONDS = int(os.getenv("OUTBOX_BACKOFF_SECONDS", "30"))
+OUTBOX_MAX_BACKOFF_SECONDS = int(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "3600"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_LEASE_SECONDS = 300
+
+# FCM errors meaning the token will never be deliverable again
+DEAD_TOKEN_ERRORS = (messaging.UnregisteredError, messaging.SenderIdMismatchError)
+
+executor = ThreadPoolExecutor(max_workers=FCM_MAX_WORKERS, thread_name_prefix="fcm")
+
+
+def _message(notification):
+    return messaging.Message(
+        notification=messaging.Notification(
+            title=notification["title"],
+            body=notification["body"],
+        ),
+        token=notification["token"],
+    )
+
+
+def _fcm_send_each(messages):
+    get_firebase_app()
+    with FCM_BATCH_LATENCY.time():
+        return messaging.send_each(messages)
+
+
+def _send_batches(notifications, sender):
+    """
+    Send notifications in FCM batches of up to 500 messages, dispatched from a bounded
+    thread pool. Returns (notification, exception or None) for every notification.
+    """
+    batches = [notifications[i:i + FCM_BATCH_SIZE] for i in range(0, len(notifications), FCM_BATCH_SIZE)]
+    futures = [executor.submit(sender, [_message(notification) for notification in batch]) for batch in batches]
+
+    results = []
+    for batch, future in zip(batches, futures):
+        try:
+            response = future.result()
+        except Exception as e:
+            logger.error(f"Error sending FCM batch of {len(batch)} messages: {e}")
+            FCM_SENDS.labels("batch_failed").inc(len(batch))
+            results.extend((notification, e) for notification in batch)
+            continue
+        for notification, result in zip(batch, response.responses):
+            FCM_SENDS.labels("success" if result.success else type(result.exception).__name__).inc()
+            results.append((notification, None if result.success else result.exception))
+    return results
+
+
+def _record_delivered(delivered):
+    # One record per user and message, however many devices received it
+    records, collapsed = {}, {}
+    timestamp = int(time.time())
+    for notification in delivered:
+        record = {
+            "user_id": notification["user_id"],
+            "title": notification["title"],
+            "body": notification["body"],
+            "timestamp": timestamp,
+            "created_at": datetime.utcnow(),
+            "read": False,
+        }
+        if notification.get("collapse_key"):
+            collapsed[(notification["user_id"], notification["collapse_key"])] = record
+        else:
+            records[(notification["user_id"], notification["title"], notification["body"])] = record
+
+    unread = Counter(record["user_id"] for record in records.values())
+    if records:
+        db.notifications.insert_many([{"_id": str(uuid4()), **record} for record in records.values()])
+    if collapsed:
+        # Repeats of a collapsible message update the user's existing record and bump its count;
+        # only records that were not already unread add to the unread counter
+        already_unread = {
+            (existing["user_id"], existing["collapse_key"])
+            for existing in db.notifications.find(
+                {"collapse_key": {"$in": list({key for _, key in collapsed})}, "read": False},
+                {"user_id": 1, "collapse_key": 1},
+            )
+        }
+        db.notifications.bulk_write([
+            UpdateOne(
+                {"user_id": user_id, "collapse_key": collapse_key},
+                {"$set": record, "$inc": {"count": 1}, "$setOnInsert": {"_id": str(uuid4())}},
+                upsert=True,
+            )
+            for (user_id, collapse_key), record in collapsed.items()
+        ], ordered=False)
+        unread.update(user_id for user_id, collapse_key in collapsed if (user_id, collapse_key) not in already_unread)
+    if unread:
+        db.users.bulk_write(
+            [UpdateOne({"_id": user_id}, {"$inc": {"unread_notifications": count}}) for user_id, count in unread.items()],
+            ordered=False,
+        )
+
+
+def reconcile_unread_counts():
+    """
+    Reset unread counters to the number of unread notifications actually stored. They drift
+    when the TTL monitor expires notifications that were never read.
+    """
+    try:
+        counts = {
+            row["_id"]: row["count"]
+            for row in db.notifications.aggregate([
+                {"$match": {"read": False}},
+                {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+            ])
+        }
+        stale = [
+            user["_id"]
+            for user in db.users.find({"unread_notifications": {"$gt": 0}}, {"_id": 1})
+            if user["_id"] not in counts
+        ]
+        updates = [
+            UpdateOne({"_id": user_id, "unread_notifications": {"$ne": count}}, {"$set": {"unread_notifications": count}})
+            for user_id, count in counts.items()
+        ]
+        if stale:
+            updates.append(UpdateMany({"_id": {"$in": stale}}, {"$set": {"unread_notifications": 0}}))
+        if updates:
+            db.users.bulk_write(updates, ordered=False)
+    except Exception as e:
+        logger.error(f"Reconciling unread notification counts failed: {e}")
+
+
+def send_notifications(notifications, sender=None):
+    """
+    Deliver {user_id, token, title, body[, collapse_key]} notifications right away and record the delivered
+    ones with a single insert_many. Returns the number of messages FCM accepted.
+    """
+    notifications = [notification for notification in notifications if notification["token"]]
+    results = _send_batches(notifications, sender or _fcm_send_each)
+    delivered = [notification for notification, error in results if error is None]
+    _record_delivered(delivered)
+    return len(delivered)
+
+
+def _outbox_entries(notifications):
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": str(uuid4()),
+            "user_id": notification["user_id"],
+            "token": notification["token"],
+            "title": notification["title"],
+            "body": notification["body"],
+            "collapse_key": notification.get("collapse_key"),
+            "attempts": 0,
+            "created_at": now,
+            "next_attempt_at": now,
+        }
+        for notification in notifications
+        if notification["token"]
+    ]
+
+
+def enqueue_notifications(notifications):
+    """
+    Queue {user_id, token, title, body[, collapse_key]} notifications in the persistent outbox.
+    Notifications sharing a collapse_key are kept as one inbox record per user.
+    """
+    outbox = _outbox_entries(notifications)
+    if outbox:
+        db.notification_outbox.insert_many(outbox)
+    return len(outbox)
+
+
+async def async_enqueue_notifications(notifications):
+    """
+    Same as enqueue_notifications, for the request path.
+    """
+    outbox = _outbox_entries(notifications)
+    if outbox:
+        await async_db.notification_outbox.insert_many(outbox)
+    return len(outbox)
+
+
+def _claim_due(limit):
+    """
+    Lease up to `limit` due outbox entries to this worker by pushing their next attempt forward.
+    """
+    now = datetime.utcnow()
+    due_ids = [entry["_id"] for entry in db.notification_outbox.find({"next_attempt_at": {"$lte": now}}, {"_id": 1}).limit(limit)]
+    if not due_ids:
+        return []
+    claim_id = str(uuid4())
+    db.notification_outbox.update_many(
+        {"_id": {"$in": due_ids}, "next_attempt_at": {"$lte": now}},
+        {"$set": {"claim_id": claim_id, "next_attempt_at": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)}},
+    )
+    return list(db.notification_outbox.find({"claim_id": claim_id}))
+
+
+def drain_outbox(sender=None):
+    """
+    Send one round of due outbox entries. Delivered entries are recorded and removed, dead
+    tokens are pruned from their users and failed entries are retried with exponential backoff.
+    Returns the number of entries processed.
+    """
+    claimed = _claim_due(FCM_BATCH_SIZE * FCM_MAX_WORKERS)
+    if not claimed:
+        return 0
+
+    now = datetime.utcnow()
+    delivered, finished, dead_tokens, retries = [], [], set(), []
+    for entry, error in _send_batches(claimed, sender or _fcm_send_each):
+        if error is None:
+            delivered.append(entry)
+            finished.append(entry["_id"])
+        elif isinstance(error, DEAD_TOKEN_ERRORS):
+            dead_tokens.add(entry["token"])
+            finished.append(entry["_id"])
+        elif entry["attempts"] + 1 >= OUTBOX_MAX_ATTEMPTS:
+            logger.error(f"Giving up on notification {entry['_id']} after {entry['attempts'] + 1} attempts: {error}")
+            finished.append(entry["_id"])
+        else:
+            backoff = min(OUTBOX_BACKOFF_SECONDS * 2 ** entry["attempts"], OUTBOX_MAX_BACKOFF_SECONDS)
+            retries.append(UpdateOne(
+                {"_id": entry["_id"]},
+                {"$inc": {"attempts": 1}, "$set": {"next_attempt_at": now + timedelta(seconds=backoff), "last_error": str(error)}},
+            ))
+
+    _record_delivered(delivered)
+    if finished:
+        db.notification_outbox.delete_many({"_id": {"$in": finished}})
+    if retries:
+        db.notification_outbox.bulk_write(retries, ordered=False)
+    if dead_tokens:
+        logger.info(f"Pruning {len(dead_tokens)} unregistered FCM tokens.")
+        db.users.update_many({"FCM_token": {"$in": list(dead_tokens)}}, {"$pull": {"FCM_token": {"$in": list(dead_tokens)}}})
+        db.notification_outbox.delete_many({"token": {"$in": list(dead_tokens)}})
+    return len(claimed)
+
+
+async def run_outbox_worker():
+    """
+    Drain the outbox forever, polling again only once it is empty.
+    """
+    while True:
+        try:
+            processed = await asyncio.to_thread(drain_outbox)
+        except Exception as e:
+            logger.error(f"Notification outbox drain failed: {e}")
+            processed = 0
+        if not processed:
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
@@ -1,53 +1,139 @@
+import logging
+import os
+import random
 from fastapi import FastAPI
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
-from app.utils import loan_contract, db, send_notification  # Import the notification function
+from pymongo.errors import BulkWriteError
+from app.utils import db
+from app.notification_dispatcher import enqueue_notifications, reconcile_unread_counts
+from app.loan_indexer import sync_loans, mark_defaults, INDEXER_INTERVAL_SECONDS, APPROVED
+from app.job_locks import run_exclusive, exclusive_job
+
+logger = logging.getLogger(__name__)
 
 scheduler = BackgroundScheduler()
 
+# Scheduler settings
+DUE_LOAN_CHECK_SECONDS = 3600
+# The due loan check is split into loan-ID ranges of this size, each claimed by one process
+DUE_LOAN_CHECK_RANGE_SIZE = int(os.getenv("DUE_LOAN_CHECK_RANGE_SIZE", "50000"))
+
+def _link_legacy_reminders(notifications):
+    # Reminders recorded before they had a collapse key carry the same text as the next reminder
+    # about their loan. Giving them its key makes that reminder update them instead of adding a
+    # second record. A text shared by reminders about two loans cannot be linked to either.
+    keys = {}
+    for notification in notifications:
+        keys.setdefault((notification["user_id"], notification["body"]), set()).add(notification["collapse_key"])
+    for (user_id, body), collapse_keys in keys.items():
+        if len(collapse_keys) != 1:
+            continue
+        collapse_key = collapse_keys.pop()
+        for legacy in db.notifications.find(
+            {"user_id": user_id, "title": "Loan Due", "body": body, "collapse_key": {"$exists": False}},
+            {"count": 1, "read": 1},
+        ):
+            existing = db.notifications.find_one({"user_id": user_id, "collapse_key": collapse_key}, {"_id": 1})
+            if existing is None:
+                db.notifications.update_one({"_id": legacy["_id"]}, {"$set": {"collapse_key": collapse_key}})
+                continue
+            db.notifications.update_one({"_id": existing["_id"]}, {"$inc": {"count": legacy.get("count", 1)}})
+            db.notifications.delete_one({"_id": legacy["_id"]})
+            if not legacy.get("read"):
+                db.users.update_one({"_id": user_id, "unread_notifications": {"$gt": 0}}, {"$inc": {"unread_notifications": -1}})
+
 # Function to check loans and send notifications
-def check_due_loans():
+def check_due_loans(loan_id_range=None):
     now = datetime.now()
     due_date_threshold = now + timedelta(days=2)
 
     try:
-        # Call the contract function to get all loans
-        all_loans = loan_contract.functions.getAllLoans().call()
-
-        # Iterate through loans and check due dates
-        for loan in all_loans:
-            loan_id = loan[0]
-            due_date = datetime.fromtimestamp(loan[7])  # Assuming loan[7] is the due date as a timestamp
-            borrower_public_key = loan[1]  # Assuming loan[1] is the borrower's public key
-            lender_public_key = loan[2]    # Assuming loan[2] is the lender's public key
-
-            # If due date is less than two days from now, send notification
-            if due_date < due_date_threshold:
-                # Fetch borrower details from the database
-                borrower = db.users.find_one({"public_key": borrower_public_key})
-                # Fetch lender details from the database to get the lender's name
-                lender = db.users.find_one({"public_key": lender_public_key})
-
-                if borrower and lender:
-                    lender_name = lender.get('name', 'Your lender')  # Get lender's name or default
-                    fcm_tokens = borrower.get('FCM_token', [])  # Get the FCM tokens as a list
-
-                    # Send notification to each token
-                    for fcm_token in fcm_tokens:
-                        if fcm_token:  # Check if the FCM token exists
-                            message = f"Don't forget to pay your loan due on {due_date.strftime('%Y-%m-%d')} from {lender_name}."
-                            send_notification(fcm_token, "Loan Due", message)
-
-    except Exception as e:
-        pass  # Handle exceptions silently or as needed
+        # Bring the local loan index up to date with the contract events, unless another
+        # process just did
+        run_exclusive("sync_loans", sync_loans, INDEXER_INTERVAL_SECONDS)
+
+        # Only active loans falling due in the next two days (served by the status/due_date index)
+        query = {
+            "status": APPROVED,
+            "due_date": {"$gte": int(now.timestamp()), "$lte": int(due_date_threshold.timestamp())},
+        }
+        if loan_id_range is not None:
+            query["_id"] = {"$gte": loan_id_range[0], "$lt": loan_id_range[1]}
+        due_loans = list(db.loans.find(query))
+
+        # Resolve every borrower and lender in a single query
+        public_keys = {loan["borrower"] for loan in due_loans} | {loan["lender"] for loan in due_loans}
+        users = db.users.find({"public_key": {"$in": list(public_keys)}}, {"name": 1, "public_key": 1, "FCM_token": 1})
+        user_lookup = {user["public_key"]: user for user in users}
+
+        reminders = []
+        for loan in due_loans:
+            borrower = user_lookup.get(loan["borrower"])
+            lender = user_lookup.get(loan["lender"])
+            if borrower and lender and any(borrower.get('FCM_token', [])):
+                reminders.append((loan, borrower, lender))
+        if not reminders:
+            return
+
+        # Remind about each loan at most once per day; the markers also keep another process from
+        # queueing the same reminders
+        markers = [f"{loan['_id']}:{now.date().isoformat()}" for loan, _, _ in reminders]
+        already_sent = set()
+        try:
+            db.reminders.insert_many([{"_id": marker, "sent_at": datetime.utcnow()} for marker in markers], ordered=False)
+        except BulkWriteError as e:
+            already_sent = {error["index"] for error in e.details["writeErrors"] if error["code"] == 11000}
+
+        # Queue one message per borrower device; the outbox worker delivers them
+        notifications = []
+        for index, (loan, borrower, lender) in enumerate(reminders):
+            if index in already_sent:
+                continue
+            due_date = datetime.fromtimestamp(loan["due_date"])
+            lender_name = lender.get('name', 'Your lender')  # Get lender's name or default
+            message = f"Don't forget to pay your loan due on {due_date.strftime('%Y-%m-%d')} from {lender_name}."
+            for fcm_token in borrower.get('FCM_token', []):
+                notifications.append({
+                    "user_id": borrower["_id"],
+                    "token": fcm_token,
+                    "title": "Loan Due",
+                    "body": message,
+                    "collapse_key": f"loan_due:{loan['_id']}",  # One inbox entry per loan, however many reminders
+                })
+        try:
+            _link_legacy_reminders(notifications)
+            enqueue_notifications(notifications)
+        except Exception:
+            # Nothing was queued; release today's markers so the next run sends these reminders
+            db.reminders.delete_many({"_id": {"$in": [marker for index, marker in enumerate(markers) if index not in already_sent]}})
+            raise
+
+    except Exception:
+        logger.exception("Due loan check failed.")
+
+def check_due_loan_shards():
+    """
+    Run the due loan check once across all processes. Every process walks the loan-ID ranges
+    in its own random order and checks the ones no other process has claimed yet.
+    """
+    highest = db.loans.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    if highest is None:
+        return
+    shards = list(range(highest["_id"] // DUE_LOAN_CHECK_RANGE_SIZE + 1))
+    random.shuffle(shards)
+    for shard in shards:
+        loan_id_range = (shard * DUE_LOAN_CHECK_RANGE_SIZE, (shard + 1) * DUE_LOAN_CHECK_RANGE_SIZE)
+        run_exclusive(f"check_due_loans:{shard}", check_due_loans, DUE_LOAN_CHECK_SECONDS, loan_id_range)
 
 # Function to start the scheduler
 def start_scheduler():
-    # Run the loan check immediately
-    check_due_loans()  # Execute immediately on startup
-
-    # Start the background scheduler
-    scheduler.add_job(check_due_loans, 'interval', minutes=60)  # Check every 2 minutes
+    # Every worker and replica runs this scheduler; Mongo job locks make each job run in one
+    # process per interval
+    scheduler.add_job(check_due_loan_shards, 'interval', seconds=DUE_LOAN_CHECK_SECONDS, next_run_time=datetime.now())  # Check every hour, starting now
+    scheduler.add_job(exclusive_job("sync_loans", sync_loans, INDEXER_INTERVAL_SECONDS), 'interval', seconds=INDEXER_INTERVAL_SECONDS)  # Follow new contract events
+    scheduler.add_job(exclusive_job("mark_defaults", mark_defaults, 3600), 'interval', minutes=60)  # Penalize loans that went past due
+    scheduler.add_job(exclusive_job("reconcile_unread_counts", reconcile_unread_counts, 24 * 3600), 'interval', hours=24)  # Account for expired notifications
     scheduler.start()
 
 # Function to shut down the scheduler
@@ -1,43 +1,67 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status
 from app.schemas import UserCreate, UserResponse, VerifyUser, AddPublicKey
 from app.models import User
-from app.database import db
-from app.utils import get_password_hash, verify_password, create_access_token,encode_private_key,get_current_user
+from app.database import async_db
+from app.utils import get_password_hash, verify_password, create_access_token,encode_private_key,get_current_user,invalidate_user
 from datetime import timedelta
 from web3 import Web3
+from pymongo.errors import DuplicateKeyError
+from app.loan_indexer import update_scores
 router = APIRouter()
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 
+def _user_document(user: UserCreate):
+    user_dict = user.dict()
+    user_dict["_id"]= user.uuid
+    user_dict.pop("uuid")
+    # Lowercased copies for indexed prefix search
+    user_dict["name_lower"] = user.name.lower()
+    user_dict["email_lower"] = user.email.lower()
+    return user_dict
+
+
+async def _insert_user(user_dict: dict):
+    try:
+        await async_db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        # Either a concurrent request registered the same user, or the wallet belongs to someone else
+        if await async_db.users.find_one({"_id": user_dict["_id"]}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="User already registered")
+        raise HTTPException(status_code=400, detail="Public key already registered to another user")
+
+
 @router.post("/verify-or-register", response_model=UserResponse)
-def verify_user(user: UserCreate):
-    db_user = db.users.find_one({"_id": user.uuid})
+async def verify_user(user: UserCreate):
+    db_user = await async_db.users.find_one({"_id": user.uuid})
     if not db_user:
-        user_dict = user.dict()
-        user_dict["friends"] = []
-        user_dict["_id"]= user.uuid
-        user_dict.pop("uuid")
-        db.users.insert_one(user_dict)
+        user_dict = _user_document(user)
+        try:
+            await _insert_user(user_dict)
+        except HTTPException:
+            # Registered by a concurrent request in the meantime
+            db_user = await async_db.users.find_one({"_id": user.uuid})
+            if not db_user:
+                raise
+            return UserResponse(**db_user)
         return UserResponse(**user_dict)
     return UserResponse(**db_user)
 
 
 @router.post("/register", response_model=UserResponse)
-def register(user: UserCreate):
-    user_dict = user.dict()
-    user_dict["friends"] = []
-    user_dict["_id"]= user.uuid
-    user_dict.pop("uuid")
-    if db.users.find_one({"email": user.email}):
+async def register(user: UserCreate):
+    user_dict = _user_document(user)
+    if await async_db.users.find_one({"email": user.email}):
         raise HTTPException(status_code=400, detail="Email already registered")
-    if db.users.find_one({"_id": user.uuid}):
+    if await async_db.users.find_one({"_id": user.uuid}):
         raise HTTPException(status_code=400, detail="User already registered")
-    db.users.insert_one(user_dict)
+    await _insert_user(user_dict)
     return UserResponse(**user_dict)
 
 @router.post("/login")
-def login(user: VerifyUser):
-    db_user = db.users.find_one({"_id": user.uuid})
+async def login(user: VerifyUser):
+    db_user = await async_db.users.find_one({"_id": user.uuid})
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(data={"sub": db_user["_id"]}, expires_delta=access_token_expires)
     
@@ -48,9 +72,21 @@ def login(user: VerifyUser):
     }
 
 @router.post("/add-public-key", response_model=AddPublicKey)
-def add_public_key(public_key: AddPublicKey, current_user: User = Depends(get_current_user)):
-    user=db.users.find_one({"_id": current_user.id})
-    if user["public_key"]:
+async def add_public_key(public_key: AddPublicKey, current_user: User = Depends(get_current_user)):
+    if current_user.public_key:
+        raise HTTPException(status_code=400, detail="Public key already")
+    address = Web3.to_checksum_address(public_key.public_key)
+    try:
+        # Only set the key if no other request has set it in the meantime
+        result = await async_db.users.update_one(
+            {"_id": current_user.id, "public_key": None},
+            {"$set": {"public_key": address}},
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Public key already registered to another user")
+    invalidate_user(current_user.id)
+    if result.matched_count == 0:
         raise HTTPException(status_code=400, detail="Public key already")
-    db.users.update_one({"_id": current_user.id}, {"$set": {"public_key": Web3.to_checksum_address(public_key.public_key)}})
+    # Pick up the reputation of loans made with this address before it was linked
+    await asyncio.to_thread(update_scores, [address])
     return public_key
\ No newline at end of file
@@ -1,80 +1,133 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import re
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from app.schemas import UserResponse,AddFriendRequest
 from app.models import User
-from app.database import db
+from app.database import async_db
 from app.utils import get_current_user
-from typing import List
+from typing import List, Optional
 
 router = APIRouter()
 
+# User search settings
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+TOP_SCORERS_LIMIT = 10
+USER_RESPONSE_PROJECTION = {"_id": 1, "email": 1, "name": 1, "public_key": 1}
+# Page size of friend listings
+FRIENDS_PAGE_SIZE = 100
+FRIENDS_MAX_PAGE_SIZE = 500
+
+
+def friendship_edges(user_id: str, friend_id: str):
+    # Friendship is mutual: one edge in each direction, created if missing
+    now = datetime.utcnow()
+    return [
+        UpdateOne({"user_id": user_id, "friend_id": friend_id}, {"$setOnInsert": {"created_at": now}}, upsert=True),
+        UpdateOne({"user_id": friend_id, "friend_id": user_id}, {"$setOnInsert": {"created_at": now}}, upsert=True),
+    ]
+
+
+async def _without_friends(cursor, user_id: str, limit: int):
+    """
+    Take up to `limit` users from a cursor, skipping the user and their friends. Friendship
+    is only looked up for the candidates in each batch.
+    """
+    results = []
+    batch = []
+
+    async def flush():
+        friend_ids = {
+            edge["friend_id"]
+            async for edge in async_db.friendships.find(
+                {"user_id": user_id, "friend_id": {"$in": [user["_id"] for user in batch]}},
+                {"friend_id": 1},
+            )
+        }
+        for user in batch:
+            if user["_id"] != user_id and user["_id"] not in friend_ids and len(results) < limit:
+                results.append(UserResponse(**user))
+        batch.clear()
+
+    async for user in cursor:
+        batch.append(user)
+        if len(batch) == limit:
+            await flush()
+            if len(results) == limit:
+                break
+    if batch:
+        await flush()
+    await cursor.close()
+    return results
+
+
 @router.post("/", response_model=UserResponse)
-def add_friend(friend:AddFriendRequest, current_user: User = Depends(get_current_user)):
+async def add_friend(friend:AddFriendRequest, current_user: User = Depends(get_current_user)):
     friend_id = friend.friend_id
     if friend_id == current_user.id:
         raise HTTPException(status_code=400, detail="You cannot add yourself as a friend")
-    friend = db.users.find_one({"_id": friend_id})
+    friend = await async_db.users.find_one({"_id": friend_id}, USER_RESPONSE_PROJECTION)
     if not friend:
         raise HTTPException(status_code=404, detail="Friend not found")
-    if friend_id in current_user.friends:
+    try:
+        result = await async_db.friendships.bulk_write(friendship_edges(current_user.id, friend_id), ordered=False)
+        added = 0 in result.upserted_ids
+    except BulkWriteError as e:
+        # A concurrent request inserted the same edge first
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        added = False
+    if not added:
         raise HTTPException(status_code=400, detail="Friend already added")
-    db.users.update_one({"_id": current_user.id}, {"$push": {"friends": friend_id}})
-    db.users.update_one({"_id": friend_id}, {"$push": {"friends": current_user.id}})
     return UserResponse(**friend)
 
 @router.get("/",response_model=List[UserResponse])
-def list_friends(current_user: User = Depends(get_current_user)):
-    friends_ids = current_user.friends
-    if not friends_ids:
+async def list_friends(
+    response: Response,
+    after: Optional[str] = Query(None, description="Return friends with an id greater than this cursor"),
+    limit: int = Query(FRIENDS_PAGE_SIZE, ge=1, le=FRIENDS_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+):
+    query = {"user_id": current_user.id}
+    if after is not None:
+        query["friend_id"] = {"$gt": after}
+    edges = await async_db.friendships.find(query, {"friend_id": 1}).sort("friend_id", 1).limit(limit).to_list(None)
+    if not edges:
         return []
 
-    friends = db.users.find({"_id": {"$in": friends_ids}})
-    friends_list = []
-    for friend in friends:
-        friend["_id"] = str(friend["_id"])  # Convert ObjectId to string
-        friends_list.append(UserResponse(**friend))
+    # A full page means there may be more; the client passes this back as `after`
+    friends_ids = [edge["friend_id"] for edge in edges]
+    if len(friends_ids) == limit:
+        response.headers["X-Next-Cursor"] = friends_ids[-1]
 
-    return friends_list
+    friends = await async_db.users.find({"_id": {"$in": friends_ids}}, USER_RESPONSE_PROJECTION).to_list(None)
+    friends.sort(key=lambda friend: friend["_id"])
+    return [UserResponse(**friend) for friend in friends]
 
 @router.get("/search", response_model=List[UserResponse])
-def search_friends(query: str, current_user: User = Depends(get_current_user)):
-    # Define the search criteria
+async def search_friends(query: str, limit: int = Query(SEARCH_LIMIT, ge=1, le=SEARCH_MAX_LIMIT), current_user: User = Depends(get_current_user)):
+    prefix = query.strip().lower()
+    if not prefix:
+        return []
+
+    # Anchored, escaped prefix matches on the lowercased fields stay within their indexes
+    pattern = "^" + re.escape(prefix)
     search_criteria = {
         "$or": [
-            {"username": {"$regex": query, "$options": "i"}},
-            {"email": {"$regex": query, "$options": "i"}}
+            {"name_lower": {"$regex": pattern}},
+            {"email_lower": {"$regex": pattern}}
         ]
     }
-    
-    # Retrieve users matching the search criteria
-    users = db.users.find(search_criteria)
-    
-    # Get the IDs of the current user's friends
-    friends_ids = set(current_user.friends)  # Convert to set for faster lookup
-
-    # Filter users to exclude those who are already friends or the current user
-    filtered_users = [
-        UserResponse(**user) 
-        for user in users 
-        if user["_id"] not in friends_ids and user["_id"] != current_user.id
-    ]
 
-    return filtered_users
+    # Exclude those who are already friends and the current user
+    cursor = async_db.users.find(search_criteria, USER_RESPONSE_PROJECTION).batch_size(limit)
+    return await _without_friends(cursor, current_user.id, limit)
 
 
 @router.get("/top-scorers", response_model=List[UserResponse])
-def top_scorers(current_user: User = Depends(get_current_user)):
-    # Retrieve users excluding current user's friends and the current user
-    users = db.users.find({
-        "_id": {
-            "$nin": current_user.friends + [current_user.id]  # Exclude friends and current user
-        }
-    }).sort("score", -1).limit(10)
-
-    # Filter users to ensure they are not friends or the current user
-    filtered_users = [
-        UserResponse(**user) 
-        for user in users 
-        if user["_id"] not in current_user.friends and user["_id"] != current_user.id
-    ]
-
-    return filtered_users
\ No newline at end of file
+async def top_scorers(current_user: User = Depends(get_current_user)):
+    # Walk the score index and skip friends and the current user as candidates come in
+    cursor = async_db.users.find({}, USER_RESPONSE_PROJECTION).sort("score", -1).batch_size(TOP_SCORERS_LIMIT)
+    return await _without_friends(cursor, current_user.id, TOP_SCORERS_LIMIT)
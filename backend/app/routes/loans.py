@@ -1,23 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from app.schemas import LoanRequest, LoanResponse, ApproveRejectLoanRequest, RepayLoanRequest, RenegotiateDueDateRequest
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from typing import List, Literal, Optional
+from datetime import datetime
+import asyncio
+import os
+from app.schemas import LoanRequest, LoanResponse, LoanDashboardResponse, LoanBatchRequest, ApproveRejectLoanRequest, RepayLoanRequest, RenegotiateDueDateRequest
 from app.models import User
-from app.database import db
-from app.utils import get_current_user, loan_contract, send_transaction
+from app.database import async_db
+from app.utils import get_current_user, get_async_loan_contract, send_transaction, cached_call, batch_call, allocate_nonces, build_transaction
+from app.loan_indexer import PENDING, APPROVED, REPAID, REJECTED
 from web3 import Web3
 
 router = APIRouter()
 
+# Page size of loan listings
+LOANS_PAGE_SIZE = int(os.getenv("LOANS_PAGE_SIZE", "100"))
+LOANS_MAX_PAGE_SIZE = int(os.getenv("LOANS_MAX_PAGE_SIZE", "500"))
+# Loans shown per dashboard view, newest first
+DASHBOARD_VIEW_SIZE = int(os.getenv("DASHBOARD_VIEW_SIZE", "100"))
+STATUS_BY_NAME = {"Pending": PENDING, "Approved": APPROVED, "Repaid": REPAID, "Rejected": REJECTED}
+
 @router.post("/request")
-def request_loan(loan: LoanRequest, current_user: User = Depends(get_current_user)):
-    lender = db.users.find_one({"_id": loan.lender_id})
+async def request_loan(loan: LoanRequest, current_user: User = Depends(get_current_user)):
+    lender = await async_db.users.find_one({"_id": loan.lender_id})
     if not lender:
         raise HTTPException(status_code=404, detail="Lender not found")
     lender_dict = dict(lender)
     due_date_timestamp=int(loan.due_date.timestamp())  # Convert due date to timestamp
     # Send loan request transaction with due date
-    tx_hash = send_transaction(
-        loan_contract.functions.requestLoan(
+    tx_hash = await send_transaction(
+        get_async_loan_contract().functions.requestLoan(
             lender_dict["public_key"],
             Web3.to_wei(loan.amount, 'ether'),
             loan.collateral,
@@ -29,39 +40,77 @@ def request_loan(loan: LoanRequest, current_user: User = Depends(get_current_use
     return {"tx": tx_hash}
 
 @router.post("/approve")
-def approve_loan(loan_request: ApproveRejectLoanRequest, current_user: User = Depends(get_current_user)):
-    loan = loan_contract.functions.loans(loan_request.loan_id).call()
+async def approve_loan(loan_request: ApproveRejectLoanRequest, current_user: User = Depends(get_current_user)):
+    loan = await cached_call(get_async_loan_contract().functions.loans(loan_request.loan_id))
     
     # Verify lender
     if Web3.to_checksum_address(current_user.public_key) != loan[2]:  # Lender address
         raise HTTPException(status_code=403, detail="Only the lender can approve the loan")
     
     # Approve loan and emit Transfer event
-    tx_hash = send_transaction(
-        loan_contract.functions.approveLoan(loan_request.loan_id),
+    tx_hash = await send_transaction(
+        get_async_loan_contract().functions.approveLoan(loan_request.loan_id),
         value=loan[3],  # Loan amount
         public_address=current_user.public_key
     )
     return {"tx": tx_hash}
 
 @router.post("/reject")
-def reject_loan(loan_request: ApproveRejectLoanRequest, current_user: User = Depends(get_current_user)):
-    loan = loan_contract.functions.loans(loan_request.loan_id).call()
+async def reject_loan(loan_request: ApproveRejectLoanRequest, current_user: User = Depends(get_current_user)):
+    loan = await cached_call(get_async_loan_contract().functions.loans(loan_request.loan_id))
     
     # Verify lender
     if current_user.public_key != loan[2]:  # Lender address
         raise HTTPException(status_code=403, detail="Only the lender can reject the loan")
     
     # Reject loan
-    tx_hash = send_transaction(
-        loan_contract.functions.rejectLoan(loan_request.loan_id),
+    tx_hash = await send_transaction(
+        get_async_loan_contract().functions.rejectLoan(loan_request.loan_id),
         public_address=current_user.public_key
     )
     return {"tx": tx_hash}
 
+@router.post("/batch")
+async def batch_loan_actions(batch: LoanBatchRequest, current_user: User = Depends(get_current_user)):
+    if not batch.actions:
+        raise HTTPException(status_code=400, detail="No actions given")
+    if current_user.public_key is None:
+        raise HTTPException(status_code=400, detail="Public key is required")
+    loan_ids = [action.loan_id for action in batch.actions]
+    if len(set(loan_ids)) != len(loan_ids):
+        raise HTTPException(status_code=400, detail="Each loan can only appear once in a batch")
+
+    # Validate every loan with a single JSON-RPC batch of loans(id) reads
+    lender = Web3.to_checksum_address(current_user.public_key)
+    contract = get_async_loan_contract()
+    loans = await batch_call([contract.functions.loans(loan_id) for loan_id in loan_ids])
+    for loan_id, loan in zip(loan_ids, loans):
+        if loan[2] != lender:  # Lender address
+            raise HTTPException(status_code=403, detail=f"Only the lender can approve or reject loan {loan_id}")
+        if loan[5] != PENDING:
+            raise HTTPException(status_code=400, detail=f"Loan {loan_id} is not pending")
+
+    approvals = [(action.loan_id, loan[3]) for action, loan in zip(batch.actions, loans) if action.action == "approve"]
+    rejections = [action.loan_id for action in batch.actions if action.action == "reject"]
+    if batch.combine:
+        # At most two transactions settle the whole batch
+        calls = []
+        if approvals:
+            calls.append((contract.functions.approveLoans([loan_id for loan_id, _ in approvals]), sum(amount for _, amount in approvals)))
+        if rejections:
+            calls.append((contract.functions.rejectLoans(rejections), 0))
+    else:
+        calls = [(contract.functions.approveLoan(loan_id), amount) for loan_id, amount in approvals]
+        calls += [(contract.functions.rejectLoan(loan_id), 0) for loan_id in rejections]
+
+    # Consecutive nonces so the wallet can submit the transactions back to back
+    nonce = await allocate_nonces(lender, len(calls))
+    txs = [await build_transaction(function, nonce + i, lender, value) for i, (function, value) in enumerate(calls)]
+    return {"txs": txs}
+
 @router.post("/repay")
-def repay_loan(loan_request: RepayLoanRequest, current_user: User = Depends(get_current_user)):
-    loan = loan_contract.functions.loans(loan_request.loan_id).call()
+async def repay_loan(loan_request: RepayLoanRequest, current_user: User = Depends(get_current_user)):
+    loan = await cached_call(get_async_loan_contract().functions.loans(loan_request.loan_id))
     
     # Verify borrower
     if current_user.public_key != loan[1]:  # Borrower address
@@ -72,88 +121,145 @@ def repay_loan(loan_request: RepayLoanRequest, current_user: User = Depends(get_
         raise HTTPException(status_code=400, detail="Loan is under renegotiation, cannot repay at this time.")
     
     # Repay loan and emit Transfer event
-    tx_hash = send_transaction(
-        loan_contract.functions.repayLoan(loan_request.loan_id),
+    tx_hash = await send_transaction(
+        get_async_loan_contract().functions.repayLoan(loan_request.loan_id),
         value=loan[3],
         public_address=current_user.public_key
     )
     return {"tx": tx_hash}
 
 @router.post("/request-renegotiation")
-def request_renegotiation(renegotiation_request: RenegotiateDueDateRequest, current_user: User = Depends(get_current_user)):
-    loan = loan_contract.functions.loans(renegotiation_request.loan_id).call()
+async def request_renegotiation(renegotiation_request: RenegotiateDueDateRequest, current_user: User = Depends(get_current_user)):
+    loan = await cached_call(get_async_loan_contract().functions.loans(renegotiation_request.loan_id))
     due_date_timestamp=int(renegotiation_request.new_due_date.timestamp())
     # Verify borrower
     if current_user.public_key != loan[1]:  # Borrower address
         raise HTTPException(status_code=403, detail="Only the borrower can request due date renegotiation.")
     
     # Request due date renegotiation
-    tx_hash = send_transaction(
-        loan_contract.functions.requestDueDateRenegotiation(renegotiation_request.loan_id, due_date_timestamp),
+    tx_hash = await send_transaction(
+        get_async_loan_contract().functions.requestDueDateRenegotiation(renegotiation_request.loan_id, due_date_timestamp),
         public_address=current_user.public_key
     )
     return {"tx": tx_hash}
 
 @router.post("/approve-renegotiation")
-def approve_renegotiation(renegotiation_request:ApproveRejectLoanRequest , current_user: User = Depends(get_current_user)):
-    loan = loan_contract.functions.loans(renegotiation_request.loan_id).call()
+async def approve_renegotiation(renegotiation_request:ApproveRejectLoanRequest , current_user: User = Depends(get_current_user)):
+    loan = await cached_call(get_async_loan_contract().functions.loans(renegotiation_request.loan_id))
     
     # Verify lender
     if current_user.public_key != loan[2]:  # Lender address
         raise HTTPException(status_code=403, detail="Only the lender can approve due date renegotiation.")
     
     # Approve due date renegotiation
-    tx_hash = send_transaction(
-        loan_contract.functions.approveDueDateRenegotiation(renegotiation_request.loan_id),
+    tx_hash = await send_transaction(
+        get_async_loan_contract().functions.approveDueDateRenegotiation(renegotiation_request.loan_id),
         public_address=current_user.public_key
     )
     return {"tx": tx_hash}
 
+# Fetch borrower and lender details of the given loans in one query using the $in operator
+async def _user_lookup(loans):
+    public_keys = {loan["borrower"] for loan in loans} | {loan["lender"] for loan in loans}  # Set of unique borrower/lender public keys
+    users = await async_db.users.find({"public_key": {"$in": list(public_keys)}}, {"name": 1, "public_key": 1}).to_list(None)
+    # Maps public_key to user ID and name
+    return {user["public_key"]: {"id": user["_id"], "name": user["name"]} for user in users}
+
+# Map indexed loans to the LoanResponse schema
+def _loan_responses(loans, user_lookup, is_borrower):
+    # Convert LoanStatus enum to string
+    status_map = {PENDING: "Pending", APPROVED: "Approved" if is_borrower else "Lended", REPAID: "Repaid", REJECTED: "Rejected"}
+
+    responses = []
+    for loan in loans:
+        borrower_info = user_lookup.get(loan["borrower"], {"id": "Unknown", "name": "Unknown"})
+        lender_info = user_lookup.get(loan["lender"], {"id": "Unknown", "name": "Unknown"})
+        
+        responses.append(LoanResponse(
+            loanId=loan["_id"],
+            borrower=borrower_info["name"],
+            borrower_id=str(borrower_info["id"]),  # Include borrower ID
+            lender=lender_info["name"],
+            lender_id=str(lender_info["id"]),  # Include lender ID
+            amount=Web3.from_wei(int(loan["amount"]), 'ether'),
+            collateral=loan["collateral"],
+            status=status_map[loan["status"]],
+            created_at=loan["created_at"],
+            due_date=loan["due_date"],  # Include due date in response
+            last_modified_at=loan["last_modified_at"],  # Include last modified date
+            renegotiation_request=loan["renegotiation_requested"],  # Include renegotiation request status
+            new_due_date=loan["requested_due_date"]  # Include requested due date
+        ))
+    return responses
+
+# Loans of a user in one of the four views (same split as getUserLoans in the contract)
+def _view_conditions(public_key, is_borrower, is_request):
+    conditions = [{"borrower" if is_borrower else "lender": public_key}]
+    if is_request:
+        conditions.append({"$or": [{"status": PENDING}, {"renegotiation_requested": True}]})
+    else:
+        conditions.append({"status": {"$in": [APPROVED, REPAID, REJECTED]}})
+    return conditions
+
 @router.get("/")
-def get_user_loans(is_borrower: bool = True, is_request: bool = False, current_user: User = Depends(get_current_user)):
+async def get_user_loans(
+    response: Response,
+    is_borrower: bool = True,
+    is_request: bool = False,
+    loan_status: Optional[Literal["Pending", "Approved", "Repaid", "Rejected"]] = Query(None, alias="status"),
+    due_after: Optional[datetime] = None,
+    due_before: Optional[datetime] = None,
+    before: Optional[int] = Query(None, description="Return loans with a loanId lower than this cursor"),
+    limit: int = Query(LOANS_PAGE_SIZE, ge=1, le=LOANS_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+):
     if current_user.public_key is None:
         return []
     
-    # Retrieve loans for the user
-    loans = loan_contract.functions.getUserLoans(Web3.to_checksum_address(current_user.public_key), is_borrower, is_request).call()
+    # Retrieve loans for the user from the local loan index
+    conditions = _view_conditions(Web3.to_checksum_address(current_user.public_key), is_borrower, is_request)
+
+    # Optional filters and the keyset cursor
+    if loan_status is not None:
+        conditions.append({"status": STATUS_BY_NAME[loan_status]})
+    if due_after is not None:
+        conditions.append({"due_date": {"$gte": int(due_after.timestamp())}})
+    if due_before is not None:
+        conditions.append({"due_date": {"$lte": int(due_before.timestamp())}})
+    if before is not None:
+        conditions.append({"_id": {"$lt": before}})
+    # Newest first, so the first page always holds the latest loans
+    loans = await async_db.loans.find({"$and": conditions}).sort("_id", -1).limit(limit).to_list(None)
 
     # If no loans found, return an empty list
     if not loans:
         return []
 
-    # Get all borrower and lender public keys from the loans in a single query
-    public_keys = {loan[1] for loan in loans} | {loan[2] for loan in loans}  # Set of unique borrower/lender public keys
+    # A full page means there may be more; the client passes this back as `before`
+    if len(loans) == limit:
+        response.headers["X-Next-Cursor"] = str(loans[-1]["_id"])
 
-    # Fetch borrower and lender details in one query using the $in operator
-    users = list(db.users.find({"public_key": {"$in": list(public_keys)}}))
-    
-    # Create a dictionary for quick lookup of user details by public_key (maps to user ID and name)
-    user_lookup = {user["public_key"]: {"id": user["_id"], "name": user["name"]} for user in users}
-    
-    # Convert LoanStatus enum to string
-    status_map = {0: "Pending", 1: "Approved" if is_borrower else "Lended", 2: "Repaid", 3: "Rejected"}
+    return _loan_responses(loans, await _user_lookup(loans), is_borrower)
 
-    # Map loans to LoanResponse schema
-    filtered_loans = []
-    for loan in loans:
-        borrower_info = user_lookup.get(loan[1], {"id": "Unknown", "name": "Unknown"})
-        lender_info = user_lookup.get(loan[2], {"id": "Unknown", "name": "Unknown"})
-        
-        filtered_loans.append(LoanResponse(
-            loanId=loan[0],
-            borrower=borrower_info["name"],
-            borrower_id=str(borrower_info["id"]),  # Include borrower ID
-            lender=lender_info["name"],
-            lender_id=str(lender_info["id"]),  # Include lender ID
-            amount=Web3.from_wei(loan[3], 'ether'),
-            collateral=loan[4],
-            status=status_map[loan[5]],
-            created_at=loan[6],
-            due_date=loan[7],  # Include due date in response
-            last_modified_at=loan[8],  # Include last modified date
-            renegotiation_request=loan[10],  # Include renegotiation request status
-            new_due_date=loan[9]  # Include requested due date
-        ))
+@router.get("/dashboard", response_model=LoanDashboardResponse)
+async def get_loan_dashboard(current_user: User = Depends(get_current_user)):
+    if current_user.public_key is None:
+        return LoanDashboardResponse(borrower_requests=[], borrower_history=[], lender_requests=[], lender_history=[])
 
-    return filtered_loans
+    # The newest DASHBOARD_VIEW_SIZE loans of each view, queried concurrently; older ones are
+    # paged through GET /loans/
+    public_key = Web3.to_checksum_address(current_user.public_key)
+    views = [(True, True), (True, False), (False, True), (False, False)]
+    borrower_requests, borrower_history, lender_requests, lender_history = await asyncio.gather(*(
+        async_db.loans.find({"$and": _view_conditions(public_key, is_borrower, is_request)}).sort("_id", -1).limit(DASHBOARD_VIEW_SIZE).to_list(None)
+        for is_borrower, is_request in views
+    ))
+    loans = borrower_requests + borrower_history + lender_requests + lender_history
+    user_lookup = await _user_lookup(loans) if loans else {}
 
+    return LoanDashboardResponse(
+        borrower_requests=_loan_responses(borrower_requests, user_lookup, True),
+        borrower_history=_loan_responses(borrower_history, user_lookup, True),
+        lender_requests=_loan_responses(lender_requests, user_lookup, False),
+        lender_history=_loan_responses(lender_history, user_lookup, False),
+    )
@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+import time
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 from uuid import uuid4
-from app.utils import send_notification
-from app.utils import User, get_current_user
-from app.utils import db
+from app.notification_dispatcher import async_enqueue_notifications
+from app.utils import User, get_current_user, invalidate_user
+from app.database import async_db
 router = APIRouter()
 
+# Page size of the notification inbox
+NOTIFICATIONS_PAGE_SIZE = 50
+NOTIFICATIONS_MAX_PAGE_SIZE = 200
+
 
 # Define a Pydantic model for the notification request
 class NotificationRequest(BaseModel):
@@ -21,15 +27,18 @@ async def send_notification_route(notification_request: NotificationRequest):
     """
     Send a notification to a specific user.
     """
-    token=db.users.find_one({"_id": notification_request.to})
+    token=await async_db.users.find_one({"_id": notification_request.to})
     if token is None:
         raise HTTPException(status_code=404, detail="User not found.")
 
     if 'FCM_token' not in token or len(token['FCM_token'])==0:
         raise HTTPException(status_code=400, detail="FCM token is required.")
-    for i in token["FCM_token"]:
-        send_notification(i, notification_request.title, notification_request.body)
-    return {"detail": "Notification sent successfully."}
+    notifications = [
+        {"user_id": token["_id"], "token": i, "title": notification_request.title, "body": notification_request.body}
+        for i in token["FCM_token"]
+    ]
+    await async_enqueue_notifications(notifications)
+    return {"detail": "Notification queued successfully."}
 
 @router.post("/store-token")
 async def store_token(token: AddToken, current_user: User = Depends(get_current_user)):
@@ -40,13 +49,10 @@ async def store_token(token: AddToken, current_user: User = Depends(get_current_
     if not token:
         raise HTTPException(status_code=400, detail="FCM token is required.")
     
-    user=db.users.find_one({"_id": current_user.id})
-    if "FCM_token" not in user:
-        db.users.update_one({"_id": current_user.id}, {"$set": {"FCM_token": [token]}})
-    elif token in user["FCM_token"]:
+    result = await async_db.users.update_one({"_id": current_user.id}, {"$addToSet": {"FCM_token": token}})
+    invalidate_user(current_user.id)
+    if result.modified_count == 0:
         return {"detail": "FCM token already stored."}
-    else:
-        db.users.update_one({"_id": current_user.id}, {"$push": {"FCM_token": token}})
     return {"detail": "FCM token stored successfully."}
 
 
@@ -56,40 +62,123 @@ class NotificationInDB(BaseModel):
     title: str
     body: str
     timestamp: int
+    read: bool = False
+
+class NotificationResponse(BaseModel):
+    id: str = Field(alias="_id")
+    title: str
+    body: str
+    timestamp: int = 0
+    read: bool = False
+    count: int = 1  # Times a collapsed message was sent
+
+class NotificationIds(BaseModel):
+    ids: List[str] = Field(..., max_length=NOTIFICATIONS_MAX_PAGE_SIZE)
+
+class MarkRead(BaseModel):
+    ids: Optional[List[str]] = Field(None, max_length=NOTIFICATIONS_MAX_PAGE_SIZE)  # None marks everything read
+
+NOTIFICATION_PROJECTION = {"_id": 1, "title": 1, "body": 1, "timestamp": 1, "read": 1, "count": 1}
+
+async def _add_unread(user_id: str, count: int):
+    # Unread counter kept on the user so the badge never needs a count query
+    if count:
+        await async_db.users.update_one({"_id": user_id}, {"$inc": {"unread_notifications": count}})
+
+async def _delete_notifications(user_id: str, query: dict):
+    # Unread ones are deleted first so the counter drops by exactly what was removed
+    unread = await async_db.notifications.delete_many({**query, "user_id": user_id, "read": False})
+    rest = await async_db.notifications.delete_many({**query, "user_id": user_id})
+    await _add_unread(user_id, -unread.deleted_count)
+    return unread.deleted_count + rest.deleted_count
 
 @router.post("/store")
 async def store_notification(notification: NotificationRequest):
     """
     Store a notification in the database.
     """
-    user=db.users.find_one({"FCM_token":{ "$in": [notification.to]}})
+    user=await async_db.users.find_one({"FCM_token":{ "$in": [notification.to]}})
     if not user:
         raise HTTPException(status_code=404, detail="User not found.")
     notification=notification.dict()
     notification["user_id"]=user["_id"]
     notification["_id"]=str(uuid4())
+    notification["timestamp"]=int(time.time())
+    notification["created_at"]=datetime.utcnow()  # TTL retention
+    notification["read"]=False
     notification.pop("to")
-    db.notifications.insert_one(notification)
+    await async_db.notifications.insert_one(notification)
+    await _add_unread(user["_id"], 1)
     return {"detail": "Notification stored successfully."}
 
-@router.get("/list")
-async def list_notifications(current_user: User = Depends(get_current_user)):
+@router.get("/list", response_model=List[NotificationResponse])
+async def list_notifications(
+    response: Response,
+    before: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
+    limit: int = Query(NOTIFICATIONS_PAGE_SIZE, ge=1, le=NOTIFICATIONS_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    List the current user's notifications, newest first, one page at a time.
+    """
+    query = {"user_id": current_user.id}
+    if before is not None:
+        try:
+            timestamp, notification_id = before.split(":", 1)
+            timestamp = int(timestamp)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": notification_id}},
+        ]
+    notifications = await async_db.notifications.find(query, NOTIFICATION_PROJECTION).sort(
+        [("timestamp", -1), ("_id", -1)]
+    ).limit(limit).to_list(None)
+
+    # A full page means there may be more; the client passes this back as `before`
+    if len(notifications) == limit:
+        last = notifications[-1]
+        response.headers["X-Next-Cursor"] = f"{last.get('timestamp', 0)}:{last['_id']}"
+    return notifications
+
+@router.get("/unread-count")
+async def unread_count(current_user: User = Depends(get_current_user)):
+    """
+    Number of unread notifications of the current user.
+    """
+    user = await async_db.users.find_one({"_id": current_user.id}, {"unread_notifications": 1})
+    return {"unread": max(user.get("unread_notifications", 0), 0) if user else 0}
+
+@router.post("/mark-read")
+async def mark_read(request: MarkRead, current_user: User = Depends(get_current_user)):
+    """
+    Mark the given notifications, or all of them, as read.
+    """
+    query = {"user_id": current_user.id, "read": False}
+    if request.ids is not None:
+        query["_id"] = {"$in": request.ids}
+    result = await async_db.notifications.update_many(query, {"$set": {"read": True}})
+    await _add_unread(current_user.id, -result.modified_count)
+    return {"detail": "Notifications marked as read.", "updated": result.modified_count}
+
+@router.post("/delete")
+async def delete_notifications(request: NotificationIds, current_user: User = Depends(get_current_user)):
     """
-    List all notifications for the current user.
+    Delete several notifications of the current user at once.
     """
-    notifications = db.notifications.find({"user_id": current_user.id})
-    print(notifications)
-    return[notification for notification in notifications]
+    deleted = await _delete_notifications(current_user.id, {"_id": {"$in": request.ids}})
+    return {"detail": "Notifications deleted successfully.", "deleted": deleted}
 
 @router.delete("/delete/{notification_id}")
 async def delete_notification(notification_id: str, current_user: User = Depends(get_current_user)):
     """
     Delete a notification by ID.
     """
-    notification = db.notifications.find_one({"_id": notification_id})
+    notification = await async_db.notifications.find_one({"_id": notification_id})
     if not notification:
         raise HTTPException(status_code=404, detail="Notification not found.")
     if notification["user_id"] != current_user.id:
         raise HTTPException(status_code=403, detail="You are not authorized to delete this notification.")
-    db.notifications.delete_one({"_id": notification_id})
+    await _delete_notifications(current_user.id, {"_id": notification_id})
     return {"detail": "Notification deleted successfully."}
\ No newline at end of file
@@ -0,0 +1,42 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from web3 import Web3
+from app.loan_updates import broker
+from app.utils import get_current_user
+
+router = APIRouter()
+
+
+@router.websocket("/loans")
+async def loan_updates(websocket: WebSocket, token: str):
+    """
+    Push an update whenever a loan of the current user changes on chain. Browsers cannot
+    set headers on a WebSocket, so the access token is passed as a query parameter.
+    """
+    try:
+        current_user = await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    if current_user.public_key is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="No public key registered")
+        return
+
+    await websocket.accept()
+    address = Web3.to_checksum_address(current_user.public_key)
+    queue = broker.subscribe(address)
+
+    async def forward():
+        while True:
+            await websocket.send_json(await queue.get())
+
+    sender = asyncio.create_task(forward())
+    try:
+        # Clients do not send anything; this only returns once they disconnect
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        broker.unsubscribe(address, queue)
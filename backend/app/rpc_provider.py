@@ -0,0 +1,104 @@
+import asyncio
+import os
+import time
+from web3 import AsyncHTTPProvider, HTTPProvider
+from app.metrics import RPC_LATENCY, RPC_BATCH_SIZE
+
+# Coalescing settings
+RPC_BATCH_WINDOW_MS = float(os.getenv("RPC_BATCH_WINDOW_MS", "2"))
+RPC_BATCH_MAX_SIZE = int(os.getenv("RPC_BATCH_MAX_SIZE", "100"))
+COALESCED_METHODS = {"eth_call"}
+
+
+class CoalescingHTTPProvider(AsyncHTTPProvider):
+    """
+    AsyncHTTPProvider that collects eth_calls made within a short window and sends them
+    to the node as one JSON-RPC batch request. The chain id, which web3 looks up before
+    every call, is fetched once. Every request is timed per method.
+    """
+
+    def __init__(self, endpoint_uri=None, batch_window_ms=RPC_BATCH_WINDOW_MS, batch_max_size=RPC_BATCH_MAX_SIZE, **kwargs):
+        super().__init__(endpoint_uri, **kwargs)
+        self.batch_window = batch_window_ms / 1000
+        self.batch_max_size = batch_max_size
+        self._pending = []
+        self._flush_handle = None
+        self._chain_id = None
+
+    async def make_request(self, method, params):
+        if method == "eth_chainId":
+            return await self._get_chain_id(params)
+        if method not in COALESCED_METHODS or self.batch_window <= 0:
+            return await self._timed_request(method, params)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((method, params, future))
+        if len(self._pending) >= self.batch_max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+        return await future
+
+    async def make_batch_request(self, batch_requests):
+        started = time.perf_counter()
+        try:
+            return await super().make_batch_request(batch_requests)
+        finally:
+            RPC_LATENCY.labels("batch").observe(time.perf_counter() - started)
+            RPC_BATCH_SIZE.observe(len(batch_requests))
+
+    async def _get_chain_id(self, params):
+        # Concurrent callers share one in-flight request; a failed lookup is retried next time
+        if self._chain_id is None:
+            self._chain_id = asyncio.ensure_future(self._timed_request("eth_chainId", params))
+        chain_id = self._chain_id
+        try:
+            response = await asyncio.shield(chain_id)
+        except Exception:
+            if self._chain_id is chain_id:
+                self._chain_id = None
+            raise
+        if "error" in response and self._chain_id is chain_id:
+            self._chain_id = None
+        return response
+
+    async def _timed_request(self, method, params):
+        started = time.perf_counter()
+        try:
+            return await super().make_request(method, params)
+        finally:
+            RPC_LATENCY.labels(method).observe(time.perf_counter() - started)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if pending:
+            asyncio.ensure_future(self._send(pending))
+
+    async def _send(self, pending):
+        try:
+            if len(pending) == 1:
+                method, params, _ = pending[0]
+                responses = [await self._timed_request(method, params)]
+            else:
+                responses = await self.make_batch_request([(method, params) for method, params, _ in pending])
+        except Exception as e:
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), response in zip(pending, responses):
+            if not future.done():
+                future.set_result(response)
+
+
+class TimedHTTPProvider(HTTPProvider):
+    """
+    HTTPProvider of the scheduler threads, timing every request per method.
+    """
+
+    def make_request(self, method, params):
+        with RPC_LATENCY.labels(method).time():
+            return super().make_request(method, params)
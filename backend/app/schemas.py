@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import List, Literal, Optional
 
 class UserCreate(BaseModel):
     uuid: str
@@ -44,12 +44,29 @@ class LoanResponse(BaseModel):
     borrower_id: str
     lender_id: str
 
+class LoanDashboardResponse(BaseModel):
+    borrower_requests: List[LoanResponse]
+    borrower_history: List[LoanResponse]
+    lender_requests: List[LoanResponse]
+    lender_history: List[LoanResponse]
+
 class LoanActionResponse(BaseModel):
     transaction_hash: str
 
 class ApproveRejectLoanRequest(BaseModel):
     loan_id: int
 
+class LoanBatchAction(BaseModel):
+    action: Literal["approve", "reject"]
+    loan_id: int
+
+# Keeps a combined approveLoans/rejectLoans well under the block gas limit
+LOAN_BATCH_MAX_SIZE = 100
+
+class LoanBatchRequest(BaseModel):
+    actions: List[LoanBatchAction] = Field(..., max_length=LOAN_BATCH_MAX_SIZE)
+    combine: bool = True  # Use approveLoans/rejectLoans instead of one transaction per loan
+
 class RepayLoanRequest(BaseModel):
     loan_id: int
     amount: float
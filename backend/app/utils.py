@@ -4,22 +4,43 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from app.models import User
-from app.database import db
-from web3 import Web3
+from app.cache import TTLCache
+from app.database import db, async_db
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from web3 import Web3, AsyncWeb3
+from web3.exceptions import Web3RPCError
+from eth_utils.abi import get_abi_output_types
+from hexbytes import HexBytes
+from web3._utils.abi import map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from requests import Session
+from requests.adapters import HTTPAdapter
+import asyncio
+import functools
 import json
+import logging
 import os
+import threading
+import time
 import hashlib
 from base64 import b64encode, b64decode
+from collections import Counter
 from dotenv import load_dotenv
 import firebase_admin
-from firebase_admin import credentials,messaging
-from uuid import uuid4
+from firebase_admin import credentials
+from app.rpc_provider import CoalescingHTTPProvider, TimedHTTPProvider
+from app.metrics import CONTRACT_CALLS, CONTRACT_CALL_LATENCY
 
 # Load environment variables from .env file
 load_dotenv()
 
-cred = credentials.Certificate(r"C:\Users\Muhammad Sadiq\Desktop\Blockchain Project\backend\serviceAccount.json")
-firebase_admin.initialize_app(cred)
+logger = logging.getLogger(__name__)
+
+# Firebase service account, loaded the first time a notification is sent
+FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS", os.path.join(os.path.dirname(os.path.dirname(__file__)), "serviceAccount.json"))
+_firebase_lock = threading.Lock()
 
 # Configure password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -28,17 +49,143 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Authenticated user cache
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
 # Web3 settings
 ganache_url = os.getenv("GANACHE_URL")
-web3 = Web3(Web3.HTTPProvider(ganache_url))
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "100"))
+RPC_TIMEOUT_SECONDS = float(os.getenv("RPC_TIMEOUT_SECONDS", "10"))
+RPC_CONNECT_TIMEOUT_SECONDS = float(os.getenv("RPC_CONNECT_TIMEOUT_SECONDS", "2"))
+RPC_KEEPALIVE_SECONDS = float(os.getenv("RPC_KEEPALIVE_SECONDS", "60"))
+# The scheduler threads share a small pooled session of their own
+_sync_rpc_session = Session()
+_sync_rpc_session.mount("http://", HTTPAdapter(pool_maxsize=4))
+_sync_rpc_session.mount("https://", HTTPAdapter(pool_maxsize=4))
+web3 = Web3(TimedHTTPProvider(
+    ganache_url,
+    session=_sync_rpc_session,
+    request_kwargs={"timeout": (RPC_CONNECT_TIMEOUT_SECONDS, RPC_TIMEOUT_SECONDS)},
+))
+async_web3 = AsyncWeb3(CoalescingHTTPProvider(ganache_url))
+
+# Contract address and ABI, loaded on first use
+CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS")
+CONTRACT_ABI_PATH = os.getenv("CONTRACT_ABI_PATH")
+
+# Contract read cache settings
+CHAIN_HEAD_POLL_SECONDS = float(os.getenv("CHAIN_HEAD_POLL_SECONDS", "1"))
+CONTRACT_CACHE_SIZE = int(os.getenv("CONTRACT_CACHE_SIZE", "10000"))
+CONTRACT_CACHE_TTL_SECONDS = int(os.getenv("CONTRACT_CACHE_TTL_SECONDS", "300"))
+contract_cache = TTLCache(maxsize=CONTRACT_CACHE_SIZE, ttl=CONTRACT_CACHE_TTL_SECONDS)
+_chain_head = {"block": None, "checked_at": 0.0}
+_chain_head_lock = asyncio.Lock()
+_fees = {"block": None, "value": None}
+# Transaction gas settings
+GAS_ESTIMATE_MARGIN = float(os.getenv("GAS_ESTIMATE_MARGIN", "1.2"))
+GAS_ESTIMATE_TTL_SECONDS = int(os.getenv("GAS_ESTIMATE_TTL_SECONDS", "600"))
+GAS_CALLDATA_BUCKET_BYTES = 64
+GAS_FALLBACK_LIMIT = 3000000
+# Gas of these depends on the parties rather than the calldata: requestLoan writes zeroed
+# slots for a first-time borrower or lender, and approving pays out to an account that may
+# not exist yet. An estimate reused from another sender can run out of gas, so the node
+# estimates every one of them.
+UNCACHED_GAS_FUNCTIONS = {"requestLoan", "approveLoan", "approveLoans"}
+gas_estimate_cache = TTLCache(maxsize=1024, ttl=GAS_ESTIMATE_TTL_SECONDS)
+# EIP-1559 fee settings
+FEE_HISTORY_BLOCKS = int(os.getenv("FEE_HISTORY_BLOCKS", "10"))
+FEE_PRIORITY_PERCENTILE = int(os.getenv("FEE_PRIORITY_PERCENTILE", "50"))
+MIN_PRIORITY_FEE_WEI = int(os.getenv("MIN_PRIORITY_FEE_WEI", "0"))
+# Nonce counters are reseeded from the chain after this long without use
+NONCE_IDLE_SECONDS = int(os.getenv("NONCE_IDLE_SECONDS", "30"))
+
+
+def get_firebase_app():
+    with _firebase_lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            return firebase_admin.initialize_app(credentials.Certificate(FIREBASE_CREDENTIALS))
+
+@functools.cache
+def get_contract_abi():
+    with open(CONTRACT_ABI_PATH) as f:
+        return json.load(f)["abi"]
+
+# LoanContract bound to the sync provider, for the scheduler threads
+@functools.cache
+def get_loan_contract():
+    return web3.eth.contract(address=Web3.to_checksum_address(CONTRACT_ADDRESS), abi=get_contract_abi())
+
+# LoanContract bound to the async provider, for the request path
+@functools.cache
+def get_async_loan_contract():
+    return async_web3.eth.contract(address=Web3.to_checksum_address(CONTRACT_ADDRESS), abi=get_contract_abi())
+
+
+async def open_rpc_session():
+    # Keep-alive connection pool shared by every request on this worker
+    session = ClientSession(
+        connector=TCPConnector(limit=RPC_POOL_SIZE, keepalive_timeout=RPC_KEEPALIVE_SECONDS),
+        timeout=ClientTimeout(total=RPC_TIMEOUT_SECONDS, connect=RPC_CONNECT_TIMEOUT_SECONDS),
+        raise_for_status=True,
+    )
+    await async_web3.provider.cache_async_session(session)
+    return session
+
+# Latest block number, polled at most every CHAIN_HEAD_POLL_SECONDS
+async def get_chain_head():
+    async with _chain_head_lock:
+        if _chain_head["block"] is None or time.monotonic() - _chain_head["checked_at"] >= CHAIN_HEAD_POLL_SECONDS:
+            _chain_head["block"] = await async_web3.eth.block_number
+            _chain_head["checked_at"] = time.monotonic()
+        return _chain_head["block"]
+
+# Read-through cache for contract view calls, valid while the chain head stays the same
+async def cached_call(function):
+    key = (function.fn_name, tuple(function.args))
+    head = await get_chain_head()
+    entry = contract_cache.get(key)
+    if entry is not None and entry[0] == head:
+        CONTRACT_CALLS.labels(function.fn_name, "cache").inc()
+        return entry[1]
+    CONTRACT_CALLS.labels(function.fn_name, "node").inc()
+    with CONTRACT_CALL_LATENCY.labels(function.fn_name).time():
+        result = await function.call(block_identifier=head)
+    contract_cache.set(key, (head, result))
+    return result
+
+# Run several contract view calls as one JSON-RPC batch request, all at the current chain head
+async def batch_call(functions):
+    if not functions:
+        return []
+    head = await get_chain_head()
+    requests = [
+        ("eth_call", [{"to": function.address, "data": get_async_loan_contract().encode_abi(function.fn_name, args=function.args)}, hex(head)])
+        for function in functions
+    ]
+    names = Counter(function.fn_name for function in functions)
+    for name, count in names.items():
+        CONTRACT_CALLS.labels(name, "node").inc(count)
+    # A batch of one function is timed under it, a mixed batch under "batch"
+    with CONTRACT_CALL_LATENCY.labels(next(iter(names)) if len(names) == 1 else "batch").time():
+        responses = await async_web3.provider.make_batch_request(requests)
 
-# Load contract ABI and address
-contract_address = web3.to_checksum_address(os.getenv("CONTRACT_ADDRESS"))
-contract_abi_path = os.getenv("CONTRACT_ABI_PATH")
-with open(contract_abi_path) as f:
-    contract_abi = json.load(f)["abi"]
+    results = []
+    for function, response in zip(functions, responses):
+        if "error" in response:
+            raise Web3RPCError(f"{function.fn_name}{tuple(function.args)} failed: {response['error']}")
+        output_types = get_abi_output_types(function.abi)
+        decoded = async_web3.codec.decode(output_types, HexBytes(response["result"]))
+        # Same normalization as ContractFunction.call(), e.g. checksummed addresses
+        decoded = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, decoded)
+        results.append(decoded[0] if len(decoded) == 1 else decoded)
+    return results
 
-loan_contract = web3.eth.contract(address=contract_address, abi=contract_abi)
+# Drop cached reads of a loan once an event for it has been seen
+def invalidate_loan(loan_id: int):
+    contract_cache.pop(("loans", (loan_id,)))
 
 # Password hashing functions
 def verify_password(plain_password, hashed_password):
@@ -70,7 +217,7 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 # Get current user function
-def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -83,44 +230,106 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.users.find_one({"_id": _id})
+    user = user_cache.get(_id)
     if user is None:
-        raise credentials_exception
-    return User(**user)
+        user = await async_db.users.find_one({"_id": _id})
+        if user is None:
+            raise credentials_exception
+        user = User(**user)
+        # Never keep a user around longer than the token that loaded it. A user without a public
+        # key is not cached: invalidate_user only reaches this worker, and the key set through
+        # another one would stay unseen here until the entry expired. Once set it never changes.
+        if user.public_key:
+            user_cache.set(_id, user, ttl=payload.get("exp", 0) - time.time())
+    return user
 
-# Send transaction function
-def send_transaction(function, public_address,value=0):
-    # Get the nonce using the public address
-    nonce = web3.eth.get_transaction_count(public_address)
-    gas_price = web3.eth.gas_price  # get current gas price
-    txn = function.build_transaction({
-    'gas': 3000000,
+# Drop a cached user of this worker after writing to their document
+def invalidate_user(user_id: str):
+    user_cache.pop(user_id)
+
+# Fee fields of the current chain head, fetched once per block. EIP-1559 fees come from a
+# short eth_feeHistory window; nodes without a base fee get a legacy gasPrice instead.
+async def get_fees():
+    head = await get_chain_head()
+    if _fees["block"] != head:
+        try:
+            history = await async_web3.eth.fee_history(FEE_HISTORY_BLOCKS, "latest", [FEE_PRIORITY_PERCENTILE])
+            base_fee = history["baseFeePerGas"][-1]  # Base fee of the next block
+            rewards = sorted(reward[0] for reward in history["reward"])
+            priority_fee = max(rewards[len(rewards) // 2] if rewards else 0, MIN_PRIORITY_FEE_WEI)
+            # Twice the base fee stays valid through six consecutive full blocks
+            fees = {"maxFeePerGas": 2 * base_fee + priority_fee, "maxPriorityFeePerGas": priority_fee}
+        except (KeyError, ValueError, Web3RPCError):
+            fees = {"gasPrice": await async_web3.eth.gas_price}
+        _fees["value"] = fees
+        _fees["block"] = head
+    return _fees["value"]
+
+# Gas limit for a call: estimated by the node plus a safety margin, and reused for calls of
+# the same function whose calldata is about the same size. Gas of the batch functions grows
+# with every loan ID, so their array lengths are part of the key as well. Functions in
+# UNCACHED_GAS_FUNCTIONS are estimated every time.
+async def estimate_gas(function, sender, value=0):
+    cacheable = function.fn_name not in UNCACHED_GAS_FUNCTIONS
+    key = None
+    if cacheable:
+        data = get_async_loan_contract().encode_abi(function.fn_name, args=function.args)
+        array_lengths = tuple(len(arg) for arg in function.args if isinstance(arg, (list, tuple)))
+        key = (data[:10], (len(data) // 2 - 1) // GAS_CALLDATA_BUCKET_BYTES, array_lengths)
+        gas = gas_estimate_cache.get(key)
+        if gas is not None:
+            return gas
+    try:
+        estimate = await function.estimate_gas({"from": sender, "value": value})
+    except (ValueError, Web3RPCError) as e:
+        # Leave it to the wallet to report a call that would revert
+        logger.warning(f"Gas estimation of {function.fn_name} failed: {e}")
+        return GAS_FALLBACK_LIMIT
+    gas = int(estimate * GAS_ESTIMATE_MARGIN)
+    if cacheable:
+        gas_estimate_cache.set(key, gas)
+    return gas
+
+# Reseed the nonce counter of an address from its pending transaction count
+async def resync_nonce(address: str):
+    pending = await async_web3.eth.get_transaction_count(address, "pending")
+    now = datetime.utcnow()
+    # Leave the counter alone if another request reseeded or used it in the meantime
+    query = {"_id": address, "used_at": {"$lte": now - timedelta(seconds=NONCE_IDLE_SECONDS)}}
+    try:
+        await async_db.nonces.update_one(query, {"$set": {"next_nonce": pending, "used_at": now}}, upsert=True)
+    except DuplicateKeyError:
+        pass
+
+# Hand out `count` consecutive nonces for an address, atomically across requests and workers
+async def allocate_nonces(address: str, count: int = 1):
+    while True:
+        now = datetime.utcnow()
+        state = await async_db.nonces.find_one_and_update(
+            {"_id": address, "used_at": {"$gt": now - timedelta(seconds=NONCE_IDLE_SECONDS)}},
+            {"$inc": {"next_nonce": count}, "$set": {"used_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if state is not None:
+            return state["next_nonce"] - count
+        # Unknown or idle counter: the chain is the source of truth again
+        await resync_nonce(address)
+
+# Build an unsigned transaction with an already allocated nonce
+async def build_transaction(function, nonce, sender, value=0):
+    return await function.build_transaction({
+    'from': sender,
+    'gas': await estimate_gas(function, sender, value),
     'nonce': nonce,
     'value': value,
-    'gasPrice': gas_price
+    **await get_fees()
     })
-    return txn
-
-def send_notification(token: str, title: str, body: str):
-    # Create a message to send
-    message = messaging.Message(
-        notification=messaging.Notification(
-            title=title,
-            body=body,
-        ),
-        token=token,
-    )
 
-    try:
-        user=db.users.find_one({"FCM_token":{ "$in": [token]}})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found.")
-        # Send the message
-        response = messaging.send(message)
-        notification={"title":title,"body":body}
-        notification["user_id"]=user["_id"]
-        notification["_id"]=str(uuid4())
-        db.notifications.insert_one(notification)
-        print('Successfully sent message:', response)
-    except Exception as e:
-        print(f'Error sending message: {e}')
\ No newline at end of file
+# Send transaction function. The wallet signs and submits the transaction, so submission
+# errors are never seen here. A nonce handed out but never signed leaves a gap until the
+# counter has been idle for NONCE_IDLE_SECONDS and is reseeded from the chain.
+async def send_transaction(function, public_address,value=0):
+    public_address = Web3.to_checksum_address(public_address)
+    # Get the nonce using the public address
+    nonce = await allocate_nonces(public_address)
+    return await build_transaction(function, nonce, public_address, value)
@@ -0,0 +1,83 @@
+"""
+Compare user resolution strategies of check_due_loans against a local mongod.
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.bench_due_loans --loans 10000
+
+"before" is the previous per-loan find_one for borrower and lender, "after" is the
+single $in query on the indexed users.public_key used by check_due_loans now.
+Data is seeded into a throwaway database which is dropped afterwards.
+"""
+import argparse
+import os
+import time
+from pymongo import MongoClient, monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name in ("find", "getMore"):
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def seed(db, n_loans):
+    n_users = max(2, n_loans // 5)
+    db.users.insert_many([
+        {"_id": f"user-{i}", "name": f"User {i}", "public_key": f"0x{i:040x}", "FCM_token": [f"token-{i}"]}
+        for i in range(n_users)
+    ])
+    db.users.create_index("public_key", unique=True, partialFilterExpression={"public_key": {"$type": "string"}})
+    return [
+        {"_id": i, "borrower": f"0x{i % n_users:040x}", "lender": f"0x{(i + 1) % n_users:040x}"}
+        for i in range(n_loans)
+    ]
+
+
+def resolve_per_loan(db, loans):
+    resolved = 0
+    for loan in loans:
+        borrower = db.users.find_one({"public_key": loan["borrower"]})
+        lender = db.users.find_one({"public_key": loan["lender"]})
+        resolved += bool(borrower and lender)
+    return resolved
+
+
+def resolve_batched(db, loans):
+    public_keys = {loan["borrower"] for loan in loans} | {loan["lender"] for loan in loans}
+    users = db.users.find({"public_key": {"$in": list(public_keys)}}, {"name": 1, "public_key": 1, "FCM_token": 1})
+    user_lookup = {user["public_key"]: user for user in users}
+    return sum(1 for loan in loans if loan["borrower"] in user_lookup and loan["lender"] in user_lookup)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loans", type=int, default=10000)
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    args = parser.parse_args()
+
+    counter = CommandCounter()
+    client = MongoClient(args.mongo_uri, event_listeners=[counter])
+    client.drop_database("p2p_lending_bench")
+    db = client.p2p_lending_bench
+    try:
+        loans = seed(db, args.loans)
+        for label, strategy in (("before", resolve_per_loan), ("after", resolve_batched)):
+            counter.count = 0
+            started = time.perf_counter()
+            resolved = strategy(db, loans)
+            elapsed = time.perf_counter() - started
+            print(f"{label:>6}: {args.loans} loans, {resolved} resolved, {counter.count} queries, {elapsed * 1000:.1f} ms")
+    finally:
+        client.drop_database("p2p_lending_bench")
+
+
+if __name__ == "__main__":
+    main()
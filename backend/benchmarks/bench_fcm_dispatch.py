@@ -0,0 +1,63 @@
+"""
+Throughput of notification delivery against an in-process stand-in for FCM.
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.bench_fcm_dispatch --messages 5000 --latency-ms 40
+
+FakeFCM replaces the firebase_admin send functions; no HTTP is involved. Each call sleeps
+for --latency-ms to model one FCM round trip, whether it carries one message (the old
+messaging.send per token) or a batch of up to 500 (messaging.send_each).
+"""
+import argparse
+import time
+from firebase_admin import messaging
+from app.database import db
+from app.notification_dispatcher import send_notifications
+
+
+class FakeFCM:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def send(self, message):
+        self.calls += 1
+        time.sleep(self.latency)
+        return f"projects/bench/messages/{self.calls}"
+
+    def send_each(self, messages):
+        self.calls += 1
+        time.sleep(self.latency)
+        return messaging.BatchResponse([messaging.SendResponse({"name": "ok"}, None) for _ in messages])
+
+
+def send_one_by_one(fcm, notifications):
+    # Previous behaviour: user lookup, send and insert per token
+    for notification in notifications:
+        db.users.find_one({"FCM_token": {"$in": [notification["token"]]}})
+        fcm.send(notification)
+        db.notifications.insert_one({"user_id": notification["user_id"], "title": notification["title"], "body": notification["body"]})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=40)
+    args = parser.parse_args()
+
+    notifications = [
+        {"user_id": f"bench-user-{i}", "token": f"bench-token-{i}", "title": "Loan Due", "body": f"Reminder {i}"}
+        for i in range(args.messages)
+    ]
+    try:
+        for label, run in (("before", send_one_by_one), ("after", lambda fcm, n: send_notifications(n, sender=fcm.send_each))):
+            fcm = FakeFCM(args.latency_ms / 1000)
+            started = time.perf_counter()
+            run(fcm, notifications)
+            elapsed = time.perf_counter() - started
+            print(f"{label:>6}: {args.messages} messages, {fcm.calls} FCM calls, {elapsed:.2f} s, {args.messages / elapsed:.0f} msg/s")
+    finally:
+        db.notifications.delete_many({"user_id": {"$regex": "^bench-user-"}})
+
+
+if __name__ == "__main__":
+    main()
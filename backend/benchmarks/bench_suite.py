@@ -0,0 +1,338 @@
+"""
+Hot path benchmarks of the API and the due loan job at growing loan counts.
+
+    # local mongod and anvil (or ganache), LoanContract compiled with `truffle compile`
+    anvil --accounts 10 &
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.bench_suite --loans 1000,10000,100000
+
+    # no services: in-memory Mongo (pip install mongomock mongomock-motor), loans seeded
+    # straight into the loan index instead of through the contract
+    python -m benchmarks.bench_suite --mongomock --no-chain --loans 1000,10000
+
+For each loan count, in ascending order, the data set is topped up to that size:
+
+- LoanContract gets that many requestLoan transactions and one loan in ten is approved
+  with a due date within two days.
+- The loan index is synced from the contract events.
+- Users and notifications are seeded at a tenth of the loan count.
+
+Then throughput and p50/p99 latency are printed for GET /loans/, /friends/search and
+/notifications/list, served in-process by uvicorn. The same is printed for
+check_due_loans and for delivering its reminders to a fake FCM sink. With --json the
+rows are also written to a file, so runs can be compared.
+
+The app database p2p_lending must be empty on a real mongod; it is dropped afterwards.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from web3 import Web3
+from benchmarks.load_test import percentile, run as run_load
+
+# Loans rotate through the accounts as borrower and lender; the bench user owns the first one
+BENCH_USER = "bench-user-0"
+CHAINLESS_ACCOUNTS = 10
+# Every tenth loan is approved and falls due within two days
+DUE_SOON_EVERY = 10
+# Notifications go to the first users, so the bench user's inbox grows with the loan count
+NOTIFIED_USERS = 10
+APPROVE_BATCH_SIZE = 100
+SEND_BATCH_SIZE = 500
+FRIENDS_OF_BENCH_USER = 20
+SEARCH_QUERY = "user 1"
+
+
+def use_mongomock():
+    # Both clients share one in-memory store, like two clients of the same server
+    import mongomock
+    import pymongo
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    store = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: store
+    motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: AsyncMongoMockClient(mock_mongo_client=store)
+
+
+class Chain:
+    """
+    LoanContract on a local development node whose accounts are unlocked.
+    """
+
+    def __init__(self, rpc_url, artifact_path):
+        self.web3 = Web3(Web3.HTTPProvider(rpc_url))
+        self.accounts = self.web3.eth.accounts
+        with open(artifact_path) as f:
+            artifact = json.load(f)
+        receipt = self.web3.eth.wait_for_transaction_receipt(self.web3.eth.send_transaction({"from": self.accounts[0], "data": artifact["bytecode"]}))
+        self.deploy_block = receipt["blockNumber"]
+        self.contract = self.web3.eth.contract(address=receipt["contractAddress"], abi=artifact["abi"])
+        self.loans = 0
+
+    def _send_all(self, transactions):
+        # JSON-RPC batches of eth_sendTransaction; the node fills in nonce, gas and fees
+        last_hash = None
+        for i in range(0, len(transactions), SEND_BATCH_SIZE):
+            responses = self.web3.provider.make_batch_request([("eth_sendTransaction", [tx]) for tx in transactions[i:i + SEND_BATCH_SIZE]])
+            for response in responses:
+                if "error" in response:
+                    raise RuntimeError(f"Seeding transaction failed: {response['error']}")
+                last_hash = response["result"]
+        if last_hash is not None:
+            self.web3.eth.wait_for_transaction_receipt(last_hash)
+
+    def seed_loans(self, total):
+        now = int(time.time())
+        requests, due_soon = [], {}
+        for loan_id in range(self.loans + 1, total + 1):
+            borrower = self.accounts[loan_id % len(self.accounts)]
+            lender = self.accounts[(loan_id + 1) % len(self.accounts)]
+            soon = loan_id % DUE_SOON_EVERY == 0
+            due_date = now + (86400 if soon else 30 * 86400)
+            amount = 1000 + loan_id
+            requests.append({
+                "from": borrower,
+                "to": self.contract.address,
+                "data": self.contract.encode_abi("requestLoan", args=[lender, amount, f"collateral {loan_id}", due_date]),
+            })
+            if soon:
+                due_soon.setdefault(lender, []).append((loan_id, amount))
+        self._send_all(requests)
+
+        approvals = []
+        for lender, loans in due_soon.items():
+            for i in range(0, len(loans), APPROVE_BATCH_SIZE):
+                batch = loans[i:i + APPROVE_BATCH_SIZE]
+                approvals.append({
+                    "from": lender,
+                    "to": self.contract.address,
+                    "value": hex(sum(amount for _, amount in batch)),
+                    "data": self.contract.encode_abi("approveLoans", args=[[loan_id for loan_id, _ in batch]]),
+                })
+        self._send_all(approvals)
+        self.loans = total
+
+
+def seed_users(db, start, total, accounts):
+    # The first users own the chain accounts; the rest only take part in search
+    if total <= start:
+        return
+    db.users.insert_many([
+        {
+            "_id": f"bench-user-{i}",
+            "email": f"user{i}@bench.test",
+            "name": f"User {i}",
+            "email_lower": f"user{i}@bench.test",
+            "name_lower": f"user {i}",
+            "public_key": accounts[i] if i < len(accounts) else Web3.to_checksum_address(f"0x{i + 1:040x}"),
+            "FCM_token": [f"bench-token-{i}"],
+            "score": i % 97,
+            "unread_notifications": 0,
+        }
+        for i in range(start, total)
+    ])
+
+
+def seed_indexed_loans(db, start, total, accounts):
+    # Same documents the loan indexer materializes from LoanRequested and LoanApproved
+    now = int(time.time())
+    db.loans.insert_many([
+        {
+            "_id": loan_id,
+            "borrower": accounts[loan_id % len(accounts)],
+            "lender": accounts[(loan_id + 1) % len(accounts)],
+            "amount": str(1000 + loan_id),
+            "collateral": f"collateral {loan_id}",
+            "status": 1 if loan_id % DUE_SOON_EVERY == 0 else 0,
+            "created_at": now,
+            "due_date": now + (86400 if loan_id % DUE_SOON_EVERY == 0 else 30 * 86400),
+            "last_modified_at": now,
+            "requested_due_date": 0,
+            "renegotiation_requested": False,
+            "renegotiations": 0,
+            "defaulted": False,
+            "seq": loan_id,
+        }
+        for loan_id in range(start + 1, total + 1)
+    ])
+
+
+def seed_notifications(db, start, total, n_users):
+    if total <= start:
+        return
+    now = datetime.utcnow()
+    timestamp = int(time.time())
+    db.notifications.insert_many([
+        {
+            "_id": f"bench-notification-{i:08}",
+            "user_id": f"bench-user-{i % min(n_users, NOTIFIED_USERS)}",
+            "title": "Loan Approved",
+            "body": f"Loan {i} was approved.",
+            "timestamp": timestamp - i,
+            "created_at": now,
+            "read": False,
+        }
+        for i in range(start, total)
+    ])
+
+
+def serve(app):
+    # uvicorn in its own thread and event loop; the load comes from the main loop
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off", log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def timed_runs(func, runs, before=None):
+    latencies = []
+    for _ in range(runs):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def row(loans, name, latencies, elapsed=None, errors=0):
+    elapsed = elapsed if elapsed is not None else sum(latencies)
+    return {
+        "loans": loans,
+        "name": name,
+        "samples": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def print_row(result):
+    print(
+        f"{result['loans']:>8}  {result['name']:<24} {result['samples']:>7} {result['errors']:>6}"
+        f" {result['throughput']:>10.1f} {result['p50_ms']:>10.1f} {result['p99_ms']:>10.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loans", default="1000,10000,100000", help="Comma separated loan counts")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per endpoint and loan count")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--job-runs", type=int, default=5, help="Runs of check_due_loans per loan count")
+    parser.add_argument("--fcm-latency-ms", type=float, default=0)
+    parser.add_argument("--mongomock", action="store_true", help="Use in-memory Mongo instead of MONGO_URI")
+    parser.add_argument("--no-chain", action="store_true", help="Seed the loan index directly instead of through LoanContract")
+    parser.add_argument("--rpc-url", default=os.getenv("GANACHE_URL", "http://127.0.0.1:8545"))
+    parser.add_argument("--artifact", default=os.getenv("CONTRACT_ABI_PATH", os.path.join(os.path.dirname(__file__), "..", "..", "blockchain", "build", "contracts", "LoanContract.json")))
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.loans.split(","))
+
+    # The app reads its settings at import, so the stand-ins go in first
+    if args.mongomock:
+        use_mongomock()
+    chain = None
+    if not args.no_chain:
+        chain = Chain(args.rpc_url, args.artifact)
+        os.environ.update({
+            "GANACHE_URL": args.rpc_url,
+            "CONTRACT_ADDRESS": chain.contract.address,
+            "CONTRACT_ABI_PATH": args.artifact,
+            "CONTRACT_DEPLOY_BLOCK": str(chain.deploy_block),
+        })
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+
+    from app.database import client, db, ensure_indexes
+    from app.loan_indexer import sync_loans
+    from app.main import app
+    from app.notification_dispatcher import drain_outbox
+    from app.notification_service import check_due_loans
+    from app.utils import create_access_token
+    from benchmarks.bench_fcm_dispatch import FakeFCM
+
+    if not args.mongomock and db.list_collection_names():
+        raise SystemExit("The p2p_lending database is not empty; point MONGO_URI at a scratch mongod.")
+
+    accounts = chain.accounts if chain else [Web3.to_checksum_address(f"0x{i + 1:040x}") for i in range(CHAINLESS_ACCOUNTS)]
+    if chain is None:
+        # Nothing to index: hold the indexer's job lock for the whole run
+        db.job_locks.insert_one({"_id": "sync_loans", "owner": "benchmark", "locked_until": datetime.utcnow() + timedelta(days=1)})
+    ensure_indexes()
+
+    server, thread, base_url = serve(app)
+    token = create_access_token({"sub": BENCH_USER}, timedelta(days=1))
+    fcm = FakeFCM(args.fcm_latency_ms / 1000)
+    results, seeded = [], {"loans": 0, "users": 0, "notifications": 0}
+    print(f"{'loans':>8}  {'benchmark':<24} {'samples':>7} {'errors':>6} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    try:
+        for size in sizes:
+            n_users = max(len(accounts), size // 10)
+            seed_users(db, seeded["users"], n_users, accounts)
+            if seeded["users"] == 0:
+                db.friendships.insert_many(
+                    [{"user_id": BENCH_USER, "friend_id": f"bench-user-{i}", "created_at": datetime.utcnow()} for i in range(1, FRIENDS_OF_BENCH_USER + 1)]
+                    + [{"user_id": f"bench-user-{i}", "friend_id": BENCH_USER, "created_at": datetime.utcnow()} for i in range(1, FRIENDS_OF_BENCH_USER + 1)]
+                )
+            seed_notifications(db, seeded["notifications"], size // 10, n_users)
+            seeded.update(users=max(seeded["users"], n_users), notifications=max(seeded["notifications"], size // 10))
+
+            if chain is not None:
+                # Only the loans added for this size are indexed
+                chain.seed_loans(size)
+                results.append(row(size, "sync_loans", timed_runs(sync_loans, 1)))
+                print_row(results[-1])
+            else:
+                seed_indexed_loans(db, seeded["loans"], size, accounts)
+            seeded["loans"] = size
+
+            for name, path in (
+                ("GET /loans/", "/loans/?is_borrower=true"),
+                ("GET /friends/search", f"/friends/search?query={SEARCH_QUERY.replace(' ', '%20')}"),
+                ("GET /notifications/list", "/notifications/list"),
+            ):
+                latencies, errors, elapsed = asyncio.run(run_load(base_url + path, token, args.concurrency, args.requests))
+                results.append(row(size, name, latencies, elapsed, len(errors)))
+                print_row(results[-1])
+
+            def reset_reminders():
+                # Every run sends the same reminders again
+                db.reminders.delete_many({})
+                db.notification_outbox.delete_many({})
+
+            def deliver():
+                while drain_outbox(sender=fcm.send_each):
+                    pass
+
+            results.append(row(size, "check_due_loans", timed_runs(check_due_loans, args.job_runs, before=reset_reminders)))
+            print_row(results[-1])
+            queued = db.notification_outbox.count_documents({})
+            results.append(row(size, f"deliver {queued} reminders", timed_runs(deliver, 1)))
+            print_row(results[-1])
+    finally:
+        server.should_exit = True
+        thread.join()
+        if not args.mongomock:
+            client.drop_database(db.name)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Concurrent load test for a running API instance.
+
+    python -m benchmarks.load_test --url http://localhost:8000/loans/ --token <JWT> --concurrency 500 --requests 20000
+
+Each of --concurrency clients issues requests back to back until --requests have been sent,
+then throughput and latency percentiles are printed.
+"""
+import argparse
+import asyncio
+import time
+from aiohttp import ClientSession, TCPConnector
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def client(session, url, headers, remaining, latencies, errors):
+    while remaining:
+        remaining.pop()
+        started = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as response:
+                await response.read()
+                if response.status >= 400:
+                    errors.append(response.status)
+        except Exception as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(url, token, concurrency, total):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    remaining = list(range(total))
+    latencies, errors = [], []
+    async with ClientSession(connector=TCPConnector(limit=concurrency)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session, url, headers, remaining, latencies, errors) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--token")
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    latencies, errors, elapsed = asyncio.run(run(args.url, args.token, args.concurrency, args.requests))
+    print(f"{len(latencies)} requests, {args.concurrency} clients, {len(errors)} errors in {elapsed:.2f} s")
+    print(f"throughput: {len(latencies) / elapsed:.0f} req/s")
+    print(f"latency: p50 {percentile(latencies, 0.50) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+"""
+Run from backend/ with `python -m pytest tests` after `pip install -r requirements-dev.txt`.
+Tests that need MongoDB use mongomock and mongomock-motor in place of a server, and are
+skipped when those are not installed.
+"""
+import pytest
+
+
+@pytest.fixture
+def mock_db():
+    mongomock = pytest.importorskip("mongomock")
+    return mongomock.MongoClient().p2p_lending
@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from app.routes import auth
+from app.schemas import UserCreate
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+WALLET = "0x" + "a" * 40
+
+
+def test_reused_wallet_is_rejected(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient().p2p_lending
+    monkeypatch.setattr(auth, "async_db", db)
+
+    async def run():
+        await db.users.create_index("public_key", unique=True, partialFilterExpression={"public_key": {"$type": "string"}})
+        await auth.register(UserCreate(uuid="u1", email="a@test", name="A", public_key=WALLET))
+        for endpoint, uuid in ((auth.register, "u2"), (auth.verify_user, "u3")):
+            with pytest.raises(HTTPException) as error:
+                await endpoint(UserCreate(uuid=uuid, email=f"{uuid}@test", name="B", public_key=WALLET))
+            assert error.value.status_code == 400
+        # Registered by a concurrent request between the lookup and the insert
+        await db.users.insert_one({"_id": "u4", "email": "u4@test", "name": "C"})
+        with pytest.raises(HTTPException):
+            await auth._insert_user({"_id": "u4", "email": "u4@test", "name": "C"})
+        return await auth.verify_user(UserCreate(uuid="u4", email="u4@test", name="C"))
+
+    assert asyncio.run(run()).email == "u4@test"
+
+
+def test_users_are_cached_only_once_their_public_key_is_set(monkeypatch):
+    from app import utils
+
+    db = mongomock_motor.AsyncMongoMockClient().p2p_lending
+    monkeypatch.setattr(utils, "async_db", db)
+    monkeypatch.setattr(utils, "user_cache", utils.TTLCache(maxsize=16, ttl=60))
+    monkeypatch.setattr(utils, "SECRET_KEY", "test-secret")
+    token = utils.create_access_token({"sub": "u1"})
+
+    async def run():
+        await db.users.insert_one({"_id": "u1", "email": "a@test"})
+        assert (await utils.get_current_user(token)).public_key is None
+        # Set through another worker, whose invalidation never reaches this one
+        await db.users.update_one({"_id": "u1"}, {"$set": {"public_key": WALLET}})
+        assert (await utils.get_current_user(token)).public_key == WALLET
+        await db.users.update_one({"_id": "u1"}, {"$set": {"email": "b@test"}})
+        return await utils.get_current_user(token)
+
+    assert asyncio.run(run()).email == "a@test"
@@ -0,0 +1,29 @@
+import asyncio
+from app import utils
+
+
+class _Function:
+    # Just enough of a ContractFunction for estimate_gas; each estimate is the next gas value
+    def __init__(self, fn_name, args, gas):
+        self.fn_name, self.args, self._gas = fn_name, args, gas
+
+    async def estimate_gas(self, transaction):
+        return next(self._gas)
+
+
+class _Contract:
+    def encode_abi(self, fn_name, args):
+        return "0x12345678" + "00" * 32 * len(args)
+
+
+def test_only_state_independent_estimates_are_reused(monkeypatch):
+    monkeypatch.setattr(utils, "get_async_loan_contract", lambda: _Contract())
+    monkeypatch.setattr(utils, "gas_estimate_cache", utils.TTLCache(maxsize=16, ttl=60))
+
+    async def estimates(fn_name, args):
+        gas = iter([100000, 200000])
+        return [await utils.estimate_gas(_Function(fn_name, args, gas), sender) for sender in ("0xa", "0xb")]
+
+    # A first-time borrower pays for the zeroed storage an established one does not
+    assert asyncio.run(estimates("requestLoan", ["0xc", 1, "car", 2])) == [120000, 240000]
+    assert asyncio.run(estimates("rejectLoan", [1])) == [120000, 120000]
@@ -0,0 +1,60 @@
+import bson
+from hexbytes import HexBytes
+from app import loan_indexer
+from app.loan_indexer import MAX_DUE_DATE, PENDING, REPAID, SCORE_FUNDED, SCORE_REPAID_ON_TIME, _event_document, _loan_update, update_scores
+
+
+def _event(args, log_index=0):
+    return {
+        "args": args,
+        "transactionHash": HexBytes(b"\x01" * 32),
+        "logIndex": log_index,
+        "blockNumber": 7,
+        "blockHash": HexBytes(b"\x02" * 32),
+    }
+
+
+def test_event_with_out_of_range_due_date_is_stored(mock_db, monkeypatch):
+    monkeypatch.setattr(loan_indexer, "db", mock_db)
+    requested = _event_document("LoanRequested", _event({
+        "loanId": 1,
+        "borrower": "0x" + "a" * 40,
+        "lender": "0x" + "b" * 40,
+        "amount": 2 ** 200,
+        "collateral": "car",
+        "dueDate": 2 ** 256 - 1,
+    }), 1700000000)
+    renegotiated = _event_document("DueDateRenegotiationRequested", _event({"loanId": 1, "requestedDueDate": 2 ** 64 - 1}, 1), 1700000000)
+
+    for event in (requested, renegotiated):
+        bson.encode(event)
+    mock_db.loan_events.insert_many([requested, renegotiated])
+    mock_db.loans.bulk_write([_loan_update(requested), _loan_update(renegotiated)])
+
+    loan = mock_db.loans.find_one({"_id": 1})
+    bson.encode(loan)
+    assert loan["status"] == PENDING
+    assert loan["amount"] == str(2 ** 200)
+    assert loan["due_date"] == MAX_DUE_DATE
+    assert loan["requested_due_date"] == MAX_DUE_DATE
+
+
+def test_other_oversized_args_become_strings():
+    event = _event_document("LoanApproved", _event({"loanId": 1, "extra": 2 ** 70}), 1700000000)
+    assert event["args"]["extra"] == str(2 ** 70)
+    bson.encode(event)
+
+
+def test_loans_to_oneself_earn_no_points(mock_db, monkeypatch):
+    monkeypatch.setattr(loan_indexer, "db", mock_db)
+    alice, bob = "0x" + "a" * 40, "0x" + "b" * 40
+    mock_db.users.insert_many([{"_id": "alice", "public_key": alice}, {"_id": "bob", "public_key": bob}])
+    repaid = {"status": REPAID, "due_date": 200, "last_modified_at": 100, "renegotiations": 0, "defaulted": False}
+    mock_db.loans.insert_many(
+        [{"_id": i, "borrower": alice, "lender": alice, **repaid} for i in range(5)]
+        + [{"_id": 5, "borrower": bob, "lender": alice, **repaid}]
+    )
+    update_scores([alice, bob])
+
+    assert mock_db.users.find_one({"_id": "alice"})["score"] == SCORE_FUNDED
+    assert mock_db.users.find_one({"_id": "bob"})["score"] == SCORE_REPAID_ON_TIME
@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from fastapi import Response
+from web3 import Web3
+from app.loan_indexer import APPROVED
+from app.models import User
+from app.routes import loans
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+BORROWER = Web3.to_checksum_address("0x" + "a" * 40)
+LENDER = Web3.to_checksum_address("0x" + "b" * 40)
+
+
+def _loan(loan_id):
+    return {
+        "_id": loan_id, "borrower": BORROWER, "lender": LENDER, "amount": "1000", "collateral": "car",
+        "status": APPROVED, "created_at": 0, "due_date": 1700000000, "last_modified_at": 0,
+        "requested_due_date": 0, "renegotiation_requested": False,
+    }
+
+
+@pytest.fixture
+def async_db(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient().p2p_lending
+    monkeypatch.setattr(loans, "async_db", db)
+    return db
+
+
+def test_loans_are_paged_newest_first(async_db):
+    user = User(_id="u1", email="e", public_key=BORROWER)
+
+    async def run():
+        await async_db.loans.insert_many([_loan(loan_id) for loan_id in range(1, 8)])
+        await async_db.users.insert_many([{"_id": "u1", "name": "B", "public_key": BORROWER}, {"_id": "u2", "name": "L", "public_key": LENDER}])
+        pages, before = [], None
+        while True:
+            response = Response()
+            page = await loans.get_user_loans(response, True, False, None, None, None, before, 3, user)
+            pages.append([loan.loanId for loan in page])
+            before = response.headers.get("x-next-cursor")
+            if before is None:
+                return pages
+            before = int(before)
+
+    assert asyncio.run(run()) == [[7, 6, 5], [4, 3, 2], [1]]
+
+
+def test_dashboard_views_are_capped_newest_first(async_db, monkeypatch):
+    monkeypatch.setattr(loans, "DASHBOARD_VIEW_SIZE", 2)
+    user = User(_id="u1", email="e", public_key=BORROWER)
+
+    async def run():
+        await async_db.loans.insert_many([_loan(loan_id) for loan_id in range(1, 6)] + [{**_loan(6), "status": 0}])
+        await async_db.users.insert_many([{"_id": "u1", "name": "B", "public_key": BORROWER}, {"_id": "u2", "name": "L", "public_key": LENDER}])
+        return await loans.get_loan_dashboard(user)
+
+    dashboard = asyncio.run(run())
+    assert [loan.loanId for loan in dashboard.borrower_history] == [5, 4]
+    assert [loan.loanId for loan in dashboard.borrower_requests] == [6]
+    assert dashboard.lender_requests == [] and dashboard.lender_history == []
+
+
+def test_batch_size_is_limited():
+    from pydantic import ValidationError
+    from app.schemas import LOAN_BATCH_MAX_SIZE, LoanBatchRequest
+
+    LoanBatchRequest(actions=[{"action": "approve", "loan_id": i} for i in range(LOAN_BATCH_MAX_SIZE)])
+    with pytest.raises(ValidationError):
+        LoanBatchRequest(actions=[{"action": "approve", "loan_id": i} for i in range(LOAN_BATCH_MAX_SIZE + 1)])
@@ -0,0 +1,20 @@
+import asyncio
+from types import SimpleNamespace
+from app import main
+
+
+def test_database_preparation_is_retried_until_it_succeeds(monkeypatch):
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("Mongo is not reachable yet")
+
+    monkeypatch.setattr(main, "_prepare_database", flaky)
+    monkeypatch.setattr(main, "PREPARE_RETRY_SECONDS", 0.01)
+    app = SimpleNamespace(state=SimpleNamespace(database_prepared=False))
+    asyncio.run(main._prepare_in_background(app))
+
+    assert len(attempts) == 3
+    assert app.state.database_prepared
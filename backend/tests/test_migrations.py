@@ -0,0 +1,49 @@
+import threading
+from app import job_locks, migrations
+
+
+def test_concurrent_workers_apply_each_migration_once(mock_db, monkeypatch):
+    monkeypatch.setattr(migrations, "db", mock_db)
+    monkeypatch.setattr(job_locks, "db", mock_db)
+    monkeypatch.setattr(migrations, "MIGRATION_WAIT_SECONDS", 0.01)
+    runs = []
+
+    def slow_migration():
+        runs.append(threading.current_thread().name)
+        # Hold the lock until every worker has tried to take it
+        threading.Event().wait(0.2)
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", [("0001_test", slow_migration), ("0002_test", lambda: runs.append("second"))])
+    workers = [threading.Thread(target=migrations.run_migrations, name=f"worker-{i}") for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=10)
+
+    assert len(runs) == 2
+    assert {migration["_id"] for migration in mock_db.migrations.find()} == {"0001_test", "0002_test"}
+
+
+def test_existing_marker_counts_as_applied(mock_db, monkeypatch):
+    monkeypatch.setattr(migrations, "db", mock_db)
+    monkeypatch.setattr(job_locks, "db", mock_db)
+    mock_db.migrations.insert_one({"_id": "0001_test"})
+    monkeypatch.setattr(migrations, "MIGRATIONS", [("0001_test", lambda: 1 / 0)])
+    migrations.run_migrations()
+
+
+def test_shared_public_keys_are_unlinked(mock_db, monkeypatch):
+    from app import database
+
+    monkeypatch.setattr(migrations, "db", mock_db)
+    monkeypatch.setattr(database, "db", mock_db)
+    shared, own = "0x" + "a" * 40, "0x" + "b" * 40
+    mock_db.users.insert_many([{"_id": "u1", "public_key": shared}, {"_id": "u2", "public_key": shared}, {"_id": "u3", "public_key": own}])
+    # The unique index cannot be built yet, which must not hold up the other indexes
+    database.ensure_indexes()
+    assert "public_key_1" not in mock_db.users.index_information()
+    assert "token_1" in mock_db.notification_outbox.index_information()
+
+    migrations.flag_shared_public_keys()
+    assert [user.get("public_key") for user in mock_db.users.find(sort=[("_id", 1)])] == [None, None, own]
+    assert mock_db.users.find_one({"_id": "u2"})["conflicting_public_key"] == shared
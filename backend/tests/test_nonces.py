@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from aiohttp import web
+from web3 import Web3
+from app import utils
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+SENDER = Web3.to_checksum_address("0x" + "a" * 40)
+CONTRACT = Web3.to_checksum_address("0x" + "c" * 40)
+ABI = [{
+    "type": "function", "name": "rejectLoan", "stateMutability": "nonpayable",
+    "inputs": [{"name": "_loanId", "type": "uint256"}], "outputs": [],
+}]
+PENDING_NONCE = 5
+
+
+async def _fake_node(request):
+    # Stand-in for the chain: just the methods building a transaction needs
+    body = await request.json()
+    result = {
+        "eth_chainId": "0x539",
+        "eth_blockNumber": "0x10",
+        "eth_getTransactionCount": hex(PENDING_NONCE),
+        "eth_estimateGas": "0x7530",
+        "eth_feeHistory": {"oldestBlock": "0x6", "baseFeePerGas": ["0x64"] * 11, "gasUsedRatio": [0.5] * 10, "reward": [["0x2"]] * 10},
+    }[body["method"]]
+    return web.json_response({"jsonrpc": "2.0", "id": body["id"], "result": result})
+
+
+def test_concurrent_builds_get_distinct_nonces(monkeypatch):
+    monkeypatch.setattr(utils, "async_db", mongomock_motor.AsyncMongoMockClient().p2p_lending)
+    contract = utils.async_web3.eth.contract(address=CONTRACT, abi=ABI)
+    monkeypatch.setattr(utils, "get_async_loan_contract", lambda: contract)
+    monkeypatch.setattr(utils, "_chain_head", {"block": None, "checked_at": 0.0})
+    monkeypatch.setattr(utils, "_fees", {"block": None, "value": None})
+
+    async def run():
+        monkeypatch.setattr(utils, "_chain_head_lock", asyncio.Lock())
+        node = web.Application()
+        node.router.add_post("/", _fake_node)
+        runner = web.AppRunner(node)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(utils.async_web3.provider, "endpoint_uri", f"http://127.0.0.1:{port}")
+        session = await utils.open_rpc_session()
+        try:
+            return await asyncio.gather(*(utils.send_transaction(contract.functions.rejectLoan(i), SENDER) for i in range(50)))
+        finally:
+            await session.close()
+            await runner.cleanup()
+
+    transactions = asyncio.run(run())
+    assert sorted(tx["nonce"] for tx in transactions) == list(range(PENDING_NONCE, PENDING_NONCE + 50))
@@ -0,0 +1,62 @@
+import time
+from datetime import date, datetime, timedelta
+from app import notification_service
+from app.loan_indexer import APPROVED
+
+
+def test_failed_enqueue_leaves_reminders_for_the_next_run(mock_db, monkeypatch):
+    monkeypatch.setattr(notification_service, "db", mock_db)
+    monkeypatch.setattr(notification_service, "run_exclusive", lambda *args: False)
+    mock_db.users.insert_many([
+        {"_id": "bo", "public_key": "0xB", "name": "Bo", "FCM_token": ["token"]},
+        {"_id": "le", "public_key": "0xL", "name": "Lee"},
+    ])
+    mock_db.loans.insert_one({"_id": 1, "borrower": "0xB", "lender": "0xL", "status": APPROVED, "due_date": int(time.time()) + 86400})
+
+    def unavailable(notifications):
+        raise RuntimeError("outbox unavailable")
+
+    queued = []
+    monkeypatch.setattr(notification_service, "enqueue_notifications", unavailable)
+    notification_service.check_due_loans()
+    assert mock_db.reminders.count_documents({}) == 0
+
+    monkeypatch.setattr(notification_service, "enqueue_notifications", queued.extend)
+    notification_service.check_due_loans()
+    notification_service.check_due_loans()
+    assert [notification["collapse_key"] for notification in queued] == ["loan_due:1"]
+
+
+
+def test_legacy_reminders_are_linked_when_their_loan_is_reminded_again(mock_db, monkeypatch):
+    monkeypatch.setattr(notification_service, "db", mock_db)
+    monkeypatch.setattr(notification_service, "run_exclusive", lambda *args: False)
+    monkeypatch.setattr(notification_service, "enqueue_notifications", lambda notifications: None)
+    mock_db.users.insert_many([
+        {"_id": "bo", "public_key": "0xB", "name": "Bo", "FCM_token": ["token"], "unread_notifications": 5},
+        {"_id": "an", "public_key": "0xA", "name": "Ann"},
+        {"_id": "ki", "public_key": "0xK", "name": "Kim"},
+        {"_id": "l1", "public_key": "0xL1", "name": "Lee"},
+        {"_id": "l2", "public_key": "0xL2", "name": "Lee"},
+    ])
+    tomorrow = datetime.combine(date.today() + timedelta(days=1), datetime.min.time()).replace(hour=12)
+    due = int(tomorrow.timestamp())
+    mock_db.loans.insert_many([
+        {"_id": loan_id, "borrower": "0xB", "lender": lender, "status": APPROVED, "due_date": due}
+        for loan_id, lender in ((1, "0xA"), (2, "0xK"), (3, "0xL1"), (4, "0xL2"))
+    ])
+    body = f"Don't forget to pay your loan due on {tomorrow.strftime('%Y-%m-%d')} from {{}}."
+    mock_db.notifications.insert_many([
+        {"_id": "ann", "user_id": "bo", "title": "Loan Due", "body": body.format("Ann"), "count": 3, "read": False},
+        {"_id": "kim", "user_id": "bo", "title": "Loan Due", "body": body.format("Kim"), "read": False},
+        {"_id": "kim-keyed", "user_id": "bo", "title": "Loan Due", "body": "x", "collapse_key": "loan_due:2", "count": 1, "read": False},
+        # Loans 3 and 4 share a reminder text, so it cannot tell which one it was about
+        {"_id": "lee", "user_id": "bo", "title": "Loan Due", "body": body.format("Lee"), "read": False},
+    ])
+    notification_service.check_due_loans()
+
+    assert mock_db.notifications.find_one({"_id": "ann"})["collapse_key"] == "loan_due:1"
+    assert mock_db.notifications.find_one({"_id": "kim"}) is None
+    assert mock_db.notifications.find_one({"_id": "kim-keyed"})["count"] == 2
+    assert "collapse_key" not in mock_db.notifications.find_one({"_id": "lee"})
+    assert mock_db.users.find_one({"_id": "bo"})["unread_notifications"] == 4
@@ -9,12 +9,28 @@ contract LoanContract {
 
     enum LoanStatus { Pending, Approved, Repaid, Rejected }
 
+    // Packed into four storage slots. The loan id is the mapping key and the collateral
+    // description is only kept in the LoanRequested event, with its hash stored here.
     struct Loan {
+        address borrower;               // slot 0
+        uint64 createdAt;
+        LoanStatus status;
+        bool renegotiationRequested;
+        address lender;                 // slot 1
+        uint64 dueDate;
+        uint128 amount;                 // slot 2
+        uint64 lastModifiedAt;
+        uint64 requestedDueDate;
+        bytes32 collateralHash;         // slot 3
+    }
+
+    // Returned by the view functions, in the field order of the original Loan struct
+    struct LoanView {
         uint loanId;
         address borrower;
         address lender;
         uint amount;
-        string collateral;
+        bytes32 collateralHash;
         LoanStatus status;
         uint createdAt;
         uint dueDate;
@@ -24,8 +40,8 @@ contract LoanContract {
     }
 
     uint public loanCounter;
-    mapping(uint => Loan) public loans;
-    mapping(address => uint[]) public userLoans;
+    mapping(uint => Loan) private _loans;
+    mapping(address => uint64[]) public userLoans;
 
     event Transfer(address indexed from, address indexed to, uint256 value);
     event LoanRequested(uint indexed loanId, address indexed borrower, address indexed lender, uint amount, string collateral, uint dueDate);
@@ -35,61 +51,89 @@ contract LoanContract {
     event DueDateRenegotiationRequested(uint indexed loanId, uint requestedDueDate);
     event DueDateRenegotiationApproved(uint indexed loanId, uint newDueDate);
 
-    function requestLoan(address _lender, uint _amount, string memory _collateral, uint _dueDate) public {
+    function requestLoan(address _lender, uint _amount, string calldata _collateral, uint _dueDate) public {
         require(_amount > 0, "Loan amount must be greater than 0");
+        require(_amount <= type(uint128).max, "Loan amount too large");
         require(_lender != address(0), "Invalid lender address");
         require(_dueDate > block.timestamp, "Due date must be in the future");
+        require(_dueDate <= type(uint64).max, "Due date too far in the future");
+
+        uint loanId = ++loanCounter;
+        _loans[loanId] = Loan({
+            borrower: msg.sender,
+            createdAt: uint64(block.timestamp),
+            status: LoanStatus.Pending,
+            renegotiationRequested: false,
+            lender: _lender,
+            dueDate: uint64(_dueDate),
+            amount: uint128(_amount),
+            lastModifiedAt: uint64(block.timestamp),
+            requestedDueDate: 0,
+            collateralHash: keccak256(bytes(_collateral))
+        });
+
+        userLoans[msg.sender].push(uint64(loanId));
+        if (_lender != msg.sender) {
+            userLoans[_lender].push(uint64(loanId));
+        }
 
-        loanCounter++;
-        loans[loanCounter] = Loan(
-            loanCounter,
-            msg.sender,
-            _lender,
-            _amount,
-            _collateral,
-            LoanStatus.Pending,
-            block.timestamp,
-            _dueDate,
-            block.timestamp,
-            0,
-            false
-        );
+        emit LoanRequested(loanId, msg.sender, _lender, _amount, _collateral, _dueDate);
+    }
 
-        userLoans[msg.sender].push(loanCounter);
-        userLoans[_lender].push(loanCounter);
+    function approveLoan(uint _loanId) public payable {
+        uint amount = _approveLoan(_loanId);
+        require(msg.value == amount, "Must send the exact loan amount");
+    }
 
-        emit LoanRequested(loanCounter, msg.sender, _lender, _amount, _collateral, _dueDate);
+    // Approve several pending loans in one transaction; msg.value must cover all of them
+    function approveLoans(uint[] calldata _loanIds) public payable {
+        uint total = 0;
+        for (uint i = 0; i < _loanIds.length; i++) {
+            total += _approveLoan(_loanIds[i]);
+        }
+        require(msg.value == total, "Must send the exact total loan amount");
     }
 
-    function approveLoan(uint _loanId) public payable {
-        Loan storage loan = loans[_loanId];
+    function rejectLoan(uint _loanId) public {
+        _rejectLoan(_loanId);
+    }
+
+    // Reject several pending loans in one transaction
+    function rejectLoans(uint[] calldata _loanIds) public {
+        for (uint i = 0; i < _loanIds.length; i++) {
+            _rejectLoan(_loanIds[i]);
+        }
+    }
+
+    function _approveLoan(uint _loanId) internal returns (uint) {
+        Loan storage loan = _loans[_loanId];
         require(msg.sender == loan.lender, "Only the lender can approve the loan");
         require(loan.status == LoanStatus.Pending, "Loan is not pending");
-        require(msg.value == loan.amount, "Must send the exact loan amount");
 
         loan.status = LoanStatus.Approved;
 
         (bool success, ) = loan.borrower.call{value: loan.amount}("");
         require(success, "Transfer to borrower failed");
 
-        loan.lastModifiedAt = block.timestamp;
+        loan.lastModifiedAt = uint64(block.timestamp);
 
         emit LoanApproved(_loanId);
+        return loan.amount;
     }
 
-    function rejectLoan(uint _loanId) public {
-        Loan storage loan = loans[_loanId];
+    function _rejectLoan(uint _loanId) internal {
+        Loan storage loan = _loans[_loanId];
         require(msg.sender == loan.lender, "Only the lender can reject the loan");
         require(loan.status == LoanStatus.Pending, "Loan is not pending");
 
         loan.status = LoanStatus.Rejected;
-        loan.lastModifiedAt = block.timestamp;
+        loan.lastModifiedAt = uint64(block.timestamp);
 
         emit LoanRejected(_loanId);
     }
 
     function repayLoan(uint _loanId) public payable {
-        Loan storage loan = loans[_loanId];
+        Loan storage loan = _loans[_loanId];
         require(msg.sender == loan.borrower, "Only the borrower can repay the loan");
         require(loan.status == LoanStatus.Approved, "Loan is not approved");
         require(msg.value == loan.amount, "Must repay the exact loan amount");
@@ -100,76 +144,98 @@ contract LoanContract {
         (bool success, ) = loan.lender.call{value: loan.amount}("");
         require(success, "Transfer to lender failed");
 
-        loan.lastModifiedAt = block.timestamp;
+        loan.lastModifiedAt = uint64(block.timestamp);
 
         emit LoanRepaid(_loanId);
     }
 
     function requestDueDateRenegotiation(uint _loanId, uint _newDueDate) public {
-        Loan storage loan = loans[_loanId];
+        Loan storage loan = _loans[_loanId];
         require(msg.sender == loan.borrower, "Only the borrower can request renegotiation");
         require(loan.status == LoanStatus.Approved, "Loan must be approved to renegotiate");
         require(_newDueDate > block.timestamp, "New due date must be in the future");
+        require(_newDueDate <= type(uint64).max, "Due date too far in the future");
 
-        loan.requestedDueDate = _newDueDate;
+        loan.requestedDueDate = uint64(_newDueDate);
         loan.renegotiationRequested = true;
 
         emit DueDateRenegotiationRequested(_loanId, _newDueDate);
     }
 
     function approveDueDateRenegotiation(uint _loanId) public {
-        Loan storage loan = loans[_loanId];
+        Loan storage loan = _loans[_loanId];
         require(msg.sender == loan.lender, "Only the lender can approve renegotiation");
         require(loan.renegotiationRequested, "Renegotiation not requested");
         require(loan.requestedDueDate > block.timestamp, "New due date must be in the future");
 
         loan.dueDate = loan.requestedDueDate;
-        loan.lastModifiedAt = block.timestamp;
+        loan.lastModifiedAt = uint64(block.timestamp);
         loan.renegotiationRequested = false;
 
         emit DueDateRenegotiationApproved(_loanId, loan.dueDate);
     }
 
-    function getAllLoans() public view returns (Loan[] memory) {
-        Loan[] memory allLoans = new Loan[](loanCounter);
+    function loans(uint _loanId) public view returns (LoanView memory) {
+        return _view(_loanId, _loans[_loanId]);
+    }
+
+    function getAllLoans() public view returns (LoanView[] memory) {
+        LoanView[] memory allLoans = new LoanView[](loanCounter);
 
         for (uint i = 1; i <= loanCounter; i++) {
-            allLoans[i - 1] = loans[i];
+            allLoans[i - 1] = _view(i, _loans[i]);
         }
 
         return allLoans;
     }
 
-    function getUserLoans(address _user, bool _isBorrower, bool _requests) public view returns (Loan[] memory) {
-        uint[] storage loanIds = userLoans[_user];
+    function getUserLoans(address _user, bool _isBorrower, bool _requests) public view returns (LoanView[] memory) {
+        uint64[] storage loanIds = userLoans[_user];
+        uint length = loanIds.length;
         uint count = 0;
 
-        for (uint i = 0; i < loanIds.length; i++) {
-            Loan storage loan = loans[loanIds[i]];
-            bool isUserLoan = (_isBorrower && loan.borrower == _user) || (!_isBorrower && loan.lender == _user);
-            bool matchesRequestStatus = (_requests && (loan.status == LoanStatus.Pending || loan.renegotiationRequested)) || 
-                                        (!_requests && (loan.status == LoanStatus.Approved || loan.status == LoanStatus.Repaid || loan.status == LoanStatus.Rejected));
-            
-            if (isUserLoan && matchesRequestStatus) {
+        // Count first so only the matching loans are allocated in memory; the second pass
+        // reads the same, now warm, storage slots
+        for (uint i = 0; i < length; i++) {
+            if (_matches(_loans[loanIds[i]], _user, _isBorrower, _requests)) {
                 count++;
             }
         }
 
-        Loan[] memory filteredLoans = new Loan[](count);
+        LoanView[] memory filteredLoans = new LoanView[](count);
         count = 0;
 
-        for (uint i = 0; i < loanIds.length; i++) {
-            Loan storage loan = loans[loanIds[i]];
-            bool isUserLoan = (_isBorrower && loan.borrower == _user) || (!_isBorrower && loan.lender == _user);
-            bool matchesRequestStatus = (_requests && (loan.status == LoanStatus.Pending || loan.renegotiationRequested)) || 
-                                        (!_requests && (loan.status == LoanStatus.Approved || loan.status == LoanStatus.Repaid || loan.status == LoanStatus.Rejected));
-            
-            if (isUserLoan && matchesRequestStatus) {
-                filteredLoans[count] = loan;
+        for (uint i = 0; i < length; i++) {
+            Loan storage loan = _loans[loanIds[i]];
+            if (_matches(loan, _user, _isBorrower, _requests)) {
+                filteredLoans[count] = _view(loanIds[i], loan);
                 count++;
             }
         }
 
         return filteredLoans;
     }
-}
\ No newline at end of file
+
+    function _matches(Loan storage loan, address _user, bool _isBorrower, bool _requests) internal view returns (bool) {
+        bool isUserLoan = (_isBorrower && loan.borrower == _user) || (!_isBorrower && loan.lender == _user);
+        bool matchesRequestStatus = (_requests && (loan.status == LoanStatus.Pending || loan.renegotiationRequested)) || 
+                                    (!_requests && (loan.status == LoanStatus.Approved || loan.status == LoanStatus.Repaid || loan.status == LoanStatus.Rejected));
+        return isUserLoan && matchesRequestStatus;
+    }
+
+    function _view(uint _loanId, Loan storage loan) internal view returns (LoanView memory) {
+        return LoanView(
+            loan.borrower == address(0) ? 0 : _loanId,
+            loan.borrower,
+            loan.lender,
+            loan.amount,
+            loan.collateralHash,
+            loan.status,
+            loan.createdAt,
+            loan.dueDate,
+            loan.lastModifiedAt,
+            loan.requestedDueDate,
+            loan.renegotiationRequested
+        );
+    }
+}
@@ -0,0 +1,72 @@
+// Gas used per LoanContract operation and per view call as a user's loan count grows.
+// Usage: truffle exec scripts/gas-report.js --network development
+// GAS_REPORT_SIZES overrides the loans-per-user checkpoints (default "1000,10000").
+// GAS_REPORT_OUT also writes the rows to that JSON file, to compare runs on both sides of a change.
+const fs = require("fs");
+const LoanContract = artifacts.require("LoanContract");
+
+const SIZES = (process.env.GAS_REPORT_SIZES || "1000,10000").split(",").map(Number);
+const DAY = 24 * 60 * 60;
+
+module.exports = async function (callback) {
+  try {
+    const [borrower, lender] = await web3.eth.getAccounts();
+    const contract = await LoanContract.new();
+    const amount = web3.utils.toWei("0.01", "ether");
+    const dueDate = () => Math.floor(Date.now() / 1000) + 30 * DAY;
+    const rows = [];
+
+    const record = (operation, result) => rows.push({ operation, gasUsed: result.receipt.gasUsed });
+    const requestLoan = () => contract.requestLoan(lender, amount, "Vehicle title #1234", dueDate(), { from: borrower });
+    const loanId = (result) => result.logs.find((log) => log.event === "LoanRequested").args.loanId;
+
+    // Full lifecycle of one loan
+    let result = await requestLoan();
+    record("requestLoan", result);
+    const id = loanId(result);
+    record("approveLoan", await contract.approveLoan(id, { from: lender, value: amount }));
+    record("requestDueDateRenegotiation", await contract.requestDueDateRenegotiation(id, dueDate() + 7 * DAY, { from: borrower }));
+    record("approveDueDateRenegotiation", await contract.approveDueDateRenegotiation(id, { from: lender }));
+    record("repayLoan", await contract.repayLoan(id, { from: borrower, value: amount }));
+    record("rejectLoan", await contract.rejectLoan(loanId(await requestLoan()), { from: lender }));
+
+    // Batched approval of ten loans
+    const batch = [];
+    for (let i = 0; i < 10; i++) {
+      batch.push(loanId(await requestLoan()));
+    }
+    result = await contract.approveLoans(batch, { from: lender, value: web3.utils.toBN(amount).muln(batch.length) });
+    record("approveLoans (10 loans)", result);
+
+    // View calls are free off-chain but still bounded by the node's call gas limit
+    for (const size of SIZES) {
+      // Every loan here has the same borrower and lender, so the counter is the per-user count
+      let count = (await contract.loanCounter()).toNumber();
+      while (count < size) {
+        await requestLoan();
+        count++;
+      }
+      for (const [label, args] of [
+        ["getUserLoans borrower history", [borrower, true, false]],
+        ["getUserLoans lender requests", [lender, false, true]],
+      ]) {
+        let gasUsed;
+        try {
+          gasUsed = await contract.getUserLoans.estimateGas(...args);
+        } catch (e) {
+          gasUsed = `failed: ${e.message}`;
+        }
+        rows.push({ operation: `${label} @ ${size} loans`, gasUsed });
+      }
+      rows.push({ operation: `loans(id) @ ${size} loans`, gasUsed: await contract.loans.estimateGas(id) });
+    }
+
+    console.table(rows);
+    if (process.env.GAS_REPORT_OUT) {
+      fs.writeFileSync(process.env.GAS_REPORT_OUT, JSON.stringify(rows, null, 2));
+    }
+    callback();
+  } catch (e) {
+    callback(e);
+  }
+};
@@ -1,5 +1,5 @@
 import React, { useState, useCallback, useMemo, useEffect } from 'react';
-import { useRepayLoanMutation, useGetLoansQuery, useAddPublicKeyMutation, useRequestRenegotiationMutation, useApproveRenegotiationMutation, useSendNotificationMutation } from '../features/api/apiSlice';
+import { useRepayLoanMutation, useGetLoanDashboardQuery, useAddPublicKeyMutation, useRequestRenegotiationMutation, useApproveRenegotiationMutation, useSendNotificationMutation } from '../features/api/apiSlice';
 import LoanActions from './LoanActions';
 import { checkIfWalletIsConnected, connectWallet, sendTransaction } from '../utils/web3Utils';
 import { useSelector, useDispatch } from 'react-redux';
@@ -12,10 +12,10 @@ import DatePicker from 'react-datepicker';
 import 'react-datepicker/dist/react-datepicker.css';
 
 const tabs = [
-  { id: 'borrowed', label: 'Borrowed Loans' },
-  { id: 'lent', label: 'Lent Loans' },
-  { id: 'sent-requests', label: 'Requests Sent' },
-  { id: 'receive-requests', label: 'Requests Received' }
+  { id: 'borrowed', label: 'Borrowed Loans', view: 'borrower_history' },
+  { id: 'lent', label: 'Lent Loans', view: 'lender_history' },
+  { id: 'sent-requests', label: 'Requests Sent', view: 'borrower_requests' },
+  { id: 'receive-requests', label: 'Requests Received', view: 'lender_requests' }
 ];
 
 const LoanList = ({ requestsCount: requestCount, setRequestsCount: setRequestCount }) => {
@@ -26,12 +26,9 @@ const LoanList = ({ requestsCount: requestCount, setRequestsCount: setRequestCou
   const [showRenegotiationModal, setShowRenegotiationModal] = useState(false);
   const [selectedLoanId, setSelectedLoanId] = useState({lender_id: null, loanId: null});
 
-  const queryParams = useMemo(() => ({
-    is_borrower: tab === 'borrowed' || tab === 'sent-requests',
-    is_request: tab === 'sent-requests' || tab === 'receive-requests'
-  }), [tab]);
-
-  const { data: loans = [], isFetching: isLoadingLoans, refetch: refetchLoans } = useGetLoansQuery(queryParams);
+  // One request loads all four tabs; switching tabs does not refetch
+  const { data: dashboard, isFetching: isLoadingLoans, refetch: refetchLoans } = useGetLoanDashboardQuery();
+  const loans = useMemo(() => dashboard?.[tabs.find((t) => t.id === tab).view] ?? [], [dashboard, tab]);
   const auth = useSelector((state) => state.auth);
   const dispatch = useDispatch();
 
@@ -41,6 +38,14 @@ const LoanList = ({ requestsCount: requestCount, setRequestsCount: setRequestCou
   const [approveRenegotiation] = useApproveRenegotiationMutation();
   const [sendNotification] = useSendNotificationMutation();
 
+  // Refetch whenever the backend pushes a change to one of this user's loans
+  useEffect(() => {
+    if (!auth.token || !auth.publicKey) return;
+    const socket = new WebSocket(`${import.meta.env.VITE_API_URL.replace(/^http/, 'ws')}/ws/loans?token=${auth.token}`);
+    socket.onmessage = () => refetchLoans();
+    return () => socket.close();
+  }, [auth.token, auth.publicKey, refetchLoans]);
+
   const handleRefetchLoans = useCallback(async () => {
     setIsRefetching(true);
     try {
@@ -62,6 +62,10 @@ export const apiSlice = createApi({
       query: (request) => `/loans?is_borrower=${request.is_borrower}&is_request=${request.is_request}`,
       providesTags: ['Loans'],
     }),
+    getLoanDashboard: builder.query({
+      query: () => '/loans/dashboard',
+      providesTags: ['Loans'],
+    }),
     requestLoan: builder.mutation({
       query: (loanRequest) => ({
         url: '/loans/request',
@@ -141,6 +145,13 @@ export const apiSlice = createApi({
         method: 'DELETE',
       }),
     }),
+    deleteNotifications: builder.mutation({
+      query: (ids) => ({
+        url: '/notifications/delete',
+        method: 'POST',
+        body: { ids },
+      }),
+    }),
   }),
 });
 
@@ -153,6 +164,7 @@ export const {
   useAddFriendMutation,
   useGetTopScorersQuery,
   useGetLoansQuery,
+  useGetLoanDashboardQuery,
   useRequestLoanMutation,
   useApproveLoanMutation,
   useRejectLoanMutation,
@@ -164,4 +176,5 @@ export const {
   useStoreNotificationMutation,
   useGetNotificationsQuery,
   useDeleteNotificationMutation,
+  useDeleteNotificationsMutation,
 } = apiSlice;
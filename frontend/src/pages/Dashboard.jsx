@@ -7,7 +7,7 @@ import { clearAuth } from "../features/auth/authSlice";
 import { apiSlice } from "../features/api/apiSlice";
 import { requestNotificationPermission, messaging } from "../firebase";
 import { onMessage } from "firebase/messaging";
-import { useGetNotificationsQuery, useDeleteNotificationMutation } from "../features/api/apiSlice";
+import { useGetNotificationsQuery, useDeleteNotificationMutation, useDeleteNotificationsMutation } from "../features/api/apiSlice";
 import FriendsList from "../components/FriendsList";
 import LoanList from "../components/LoanList";
 import AddFriend from "../components/AddFriend";
@@ -26,6 +26,7 @@ const DashboardPage = () => {
   const [requestsCount, setRequestsCount] = useState(0);
   const { data: notifications, error: notificationsError, refetch: refetchNotifications } = useGetNotificationsQuery();
   const [deleteNotification] = useDeleteNotificationMutation();
+  const [deleteNotifications] = useDeleteNotificationsMutation();
   const [floatingNotification, setFloatingNotification] = useState(null);
   const dropdownRef = useRef(null);
 
@@ -102,7 +103,7 @@ const DashboardPage = () => {
   const markAllAsRead = async () => {
     try {
       const unreadNotifications = notifications.filter(n => !n.read);
-      await Promise.all(unreadNotifications.map(notification => deleteNotification(notification._id).unwrap()));
+      await deleteNotifications(unreadNotifications.map(notification => notification._id)).unwrap();
       refetchNotifications();
     } catch (err) {
       console.error("Failed to mark all notifications as read", err);